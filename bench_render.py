@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the inkscape-shell renderer against starting a new Inkscape
+for every file (the inkscape renderer).
+
+USAGE: bench_render.py [-n COUNT] [-s SIZE] [-t THREADS] <svg file>
+"""
+
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import image_proc
+from inkscape_shell import InkscapeShellPool
+
+
+
+def run_threads(jobs, num_threads, render):
+    """
+    Runs render(svg_in, png_out) over every job on `num_threads` threads,
+    returning how long it took.
+    """
+    jobs = list(jobs)
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            with lock:
+                if not jobs:
+                    return
+                svg_in, png_out = jobs.pop()
+            render(svg_in, png_out)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=work) for _ in range(num_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+
+def main():
+    count = 50
+    size = 32
+    num_threads = 1
+
+    opts, args = getopt.getopt(sys.argv[1:], 'n:s:t:')
+    for opt, arg in opts:
+        if opt == '-n':
+            count = int(arg)
+        elif opt == '-s':
+            size = int(arg)
+        elif opt == '-t':
+            num_threads = int(arg)
+
+    if len(args) != 1:
+        print(__doc__)
+        sys.exit(2)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        # give every render its own copy of the file, like an export does.
+        jobs = []
+        for i in range(count):
+            svg_in = os.path.join(tmp_dir, f'{i}.svg')
+            shutil.copyfile(args[0], svg_in)
+            jobs.append((svg_in, os.path.join(tmp_dir, f'{i}.png')))
+
+        print(f'{count} renders at {size}px on {num_threads} thread(s):')
+
+        t = run_threads(jobs, num_threads, lambda svg_in, png_out:
+                        image_proc.render_svg(svg_in, png_out, 'inkscape', size))
+        print(f'- inkscape:       {t:8.2f}s ({t / count * 1000:.1f}ms per file)')
+
+        shells = InkscapeShellPool(num_threads)
+        try:
+            t = run_threads(jobs, num_threads, lambda svg_in, png_out:
+                            shells.render(svg_in, png_out, size))
+        finally:
+            shells.close()
+        print(f'- inkscape-shell: {t:8.2f}s ({t / count * 1000:.1f}ms per file)')
+
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
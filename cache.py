@@ -1,56 +1,134 @@
 import collections
 import hashlib
+import json
 import os
-import shutil
+import threading
+import time
 
+from cache_backend import get_backend
+import files
 import svg
 import util
 
 
+
+"""The units a cache size can be given in (ie. '500M', '2G')."""
+_size_unit_map = {
+    'K': 1024,
+    'M': 1024 ** 2,
+    'G': 1024 ** 3,
+    'T': 1024 ** 4,
+}
+
+def parse_size(arg):
+    """
+    Parses a size in bytes, with an optional unit (K, M, G or T), ie. '2G'.
+    """
+    text = arg.strip().upper().rstrip('B')
+    unit = 1
+    if text and text[-1] in _size_unit_map:
+        unit = _size_unit_map[text[-1]]
+        text = text[:-1]
+
+    try:
+        size = int(float(text) * unit)
+    except ValueError:
+        size = 0
+    if size <= 0:
+        raise ValueError(f"A cache size ('{arg}') has to be a number of bytes "
+                         "above 0, optionally followed by K, M, G or T "
+                         "(ie. '2G').")
+    return size
+
+
 class Cache:
     """
     Implements a cache system for emoji.
 
-    This cache is implemented based on a cache directory where files are placed
-    in directories by the format they were exported to; the individual cache
-    files are named by their key, which is generated from:
+    This cache is implemented based on a backend (see cache_backend.py), a
+    cache directory or a cache server, where files are placed by the format
+    they were exported to; the individual cache files are named by their key,
+    which is generated from:
       - the source file of the emoji;
       - the colour modifiers applied to the emoji;
       - the license, being applied to the files, if present;
 
     This defines how the emoji looks, and makes it such that a change in either
     the source or the manifest palette will not reuse the file in cache.
+
+    Which files are in the cache is kept in an in-memory index, which is
+    loaded with a single listing for each format the first time that
+    format is looked up, and updated as files are saved to the cache.
+
+    Files are put in and taken out of a cache directory with the `link`
+    method (one of files.LINK_METHODS), falling back to more expensive
+    methods where the filesystem doesn't support it.
+
+    The hashes of the source files are kept in a source hash index in the
+    cache directory, so that only sources that changed since the last export
+    are hashed again.
+
+    If a cache directory has a `max_size` (in bytes), the files that were
+    used longest ago are evicted once it gets bigger than that (see evict()).
+
+    Besides the exports, the cache keeps the raw renders of emoji at each
+    size (see load_render()), so that a format that wasn't exported before
+    only needs its encoder to be run.
+
+    The cache also keeps statistics of how it's been used in `stats`, by
+    format (see count_lookup() and save_stats()).
     """
 
     cache_dir = None
 
+    # Name of the source hash index in the cache directory
+    source_hashes_name = '.source_hashes.json'
+
     # Formats for which a non-licensed version should never be cached
     skip_export_cache_formats = set(('svg'))
 
-    def __init__(self, cache_dir):
+    def __init__(self, cache_dir, link='copy', max_size=None, stats_path=None,
+                 pack=False):
         """
         Initiate an export cache instance. Requires a directory path (which may
-        or may not exist already) to function.
+        or may not exist already) or the URL of a cache server to function.
+        If `pack` is set, a cache directory keeps its files in pack files.
         """
         if not isinstance(cache_dir, str):
-            raise ValueError("Cache dir must be a string path")
-
-        self.cache_dir = cache_dir
-        self.initiate_cache_dir()
+            raise ValueError("Cache dir must be a string path or URL")
+        if link not in files.LINK_METHODS:
+            raise ValueError(f"'{link}' is not a way orxporter can take files "
+                             f"out of the cache. (It knows "
+                             f"{', '.join(files.LINK_METHODS)})")
 
-    def initiate_cache_dir(self):
-        """Make the cache directory if it does not exist already."""
-        if not os.path.exists(self.cache_dir):
-            try:
-                os.mkdir(self.cache_dir)
-            except OSError as exc:
-                raise RuntimeError("Cannot create cache directory "
-                                   "'{}'".format(self.cache_dir)) from exc
-        elif not os.path.isdir(self.cache_dir):
-            raise RuntimeError("Cache path '{}' exists but is not a "
-                               "directory".format(self.cache_dir))
+        self.link = link
+        self.max_size = max_size
 
-        return True
+        self.cache_dir = cache_dir
+        self.backend = get_backend(cache_dir, pack)
+
+        if max_size and not self.backend.local:
+            raise ValueError("A maximum cache size can only be given for a "
+                             "cache directory; a cache server has to clean "
+                             "itself up.")
+
+        # the cache keys in each format's directory, keyed by format
+        # (raw renders are looked up and added by the export's threads, so
+        # the index is only ever used with its lock held.)
+        self.index = {}
+        self.index_lock = threading.RLock()
+
+        self.license_hashes = None
+        self.source_hashes_changed = False
+        self.load_source_hashes()
+
+        # hits, misses, restored/stored bytes and restore/store times
+        # of each format, and the time spent working out cache keys
+        # (raw renders are saved and loaded by the export's threads.)
+        self.stats = collections.defaultdict(collections.Counter)
+        self.stats_lock = threading.Lock()
+        self.key_time = 0.0
+        self.stats_path = stats_path
 
     @staticmethod
     def generate_cache_key_from_parts(key_parts):
@@ -63,8 +141,8 @@ class Cache:
         raw_key = bytes(repr(key_parts), 'utf-8')
         return hashlib.sha256(raw_key).hexdigest()
 
-    @staticmethod
-    def get_cache_keys(emoji, manifest, emoji_src, license_enabled):
+    def get_cache_keys(self, emoji, manifest, emoji_src, license_enabled,
+                       srcpath=None):
         """
         Get the cache keys for a given emoji, base and for each license format
         if license_enabled is set.
@@ -73,22 +151,28 @@ class Cache:
             - SVG source file: Allows tracking changes to the source
             - Colour modifiers, if applicable: Tracks changes in the manifest
             - License contents, only for each of the license formats
+
+        If the path of the source file (`srcpath`) is given, its hash is
+        looked up in (and added to) the source hash index, so it's only
+        hashed again if it changed.
         """
         if 'cache_keys' in emoji:
             return emoji['cache_keys']
 
-        src = emoji_src
-        if isinstance(src, collections.abc.ByteString):
-            src = bytes(src, 'utf-8')
-        src_hash = hashlib.sha256(bytes(emoji_src, 'utf-8')).digest()
+        start = time.perf_counter()
+
+        src_hash = None
+        if srcpath:
+            src_hash = self.get_source_hash(srcpath)
+        if src_hash is None:
+            src_hash = hashlib.sha256(bytes(emoji_src, 'utf-8')).digest()
+            if srcpath:
+                self.set_source_hash(srcpath, src_hash)
 
         # Find which variable colours are in this emoji
         colors = None
         if 'color' in emoji:
-            pal_src, pal_dst = util.get_color_palettes(emoji, manifest)
-            colors = []
-
-            changed = svg.translated_colors(emoji_src, pal_src, pal_dst)
+            _, changed = svg.translate_emoji_color(emoji, manifest, emoji_src)
             colors = sorted(changed.items())
 
         # Collect the parts
@@ -102,11 +186,8 @@ class Cache:
 
         if license_enabled:
             key_licenses = {}
-            for license in manifest.license:
-                # Obtain the license to add to the key parts
-                license_content = bytes(repr(manifest.license[license]),
-                                        'utf-8')
-                key_parts = key_parts_base + (('license', license_content), )
+            for license, license_hash in self.get_license_hashes(manifest).items():
+                key_parts = key_parts_base + (('license', license_hash), )
 
                 key = Cache.generate_cache_key_from_parts(key_parts)
                 key_licenses[license] = key
@@ -116,17 +197,93 @@ class Cache:
             'licenses': key_licenses,
         }
 
+        self.key_time += time.perf_counter() - start
         return keys
 
-    def build_emoji_cache_path(self, emoji, f, license_enabled):
+    def get_license_hashes(self, manifest):
+        """
+        Get the hashes of the manifest's licenses (keyed by license type),
+        which go into the licensed cache keys. These are only worked out once
+        for each manifest.
+        """
+        if self.license_hashes is None or self.license_hashes[0] is not manifest:
+            hashes = {}
+            for license in manifest.license:
+                license_content = bytes(repr(manifest.license[license]), 'utf-8')
+                hashes[license] = hashlib.sha256(license_content).digest()
+            self.license_hashes = (manifest, hashes)
+
+        return self.license_hashes[1]
+
+    def load_source_hashes(self):
         """
-        Build the full path to the cache emoji file (regardless of existence).
-        If `license_enabled` is `True` the path for the given format with
-        license is built and returned.
+        Load the source hash index from the cache directory. This maps the
+        path of each source file to its size, modification time and hash, so
+        unchanged sources don't need to be hashed on every export.
+        """
+        self.source_hashes = {}
+        try:
+            text = self.backend.read_meta(self.source_hashes_name)
+            if text:
+                self.source_hashes = json.loads(text)
+        except (OSError, ValueError):
+            # a broken index only means hashing everything again.
+            self.source_hashes = {}
+
+    def save_source_hashes(self):
+        """Write the source hash index out to the cache directory."""
+        if not self.source_hashes_changed:
+            return
+
+        # keep what other orxporters sharing the cache have added since
+        # this one loaded the index.
+        source_hashes = self.source_hashes
+        self.load_source_hashes()
+        self.source_hashes.update(source_hashes)
+
+        try:
+            self.backend.write_meta(self.source_hashes_name,
+                                    json.dumps(self.source_hashes, sort_keys=True))
+        except OSError as exc:
+            raise RuntimeError("Unable to save the source hash index "
+                               "in '{}': {}".format(self.cache_dir, str(exc)))
+        self.source_hashes_changed = False
+
+    @staticmethod
+    def source_stamp(srcpath):
+        """
+        Get the (absolute) path, size and modification time of a source file,
+        as they are kept in the source hash index.
+        """
+        st = os.stat(srcpath)
+        return os.path.abspath(srcpath), st.st_size, st.st_mtime_ns
+
+    def get_source_hash(self, srcpath):
+        """
+        Get the hash of a source file from the source hash index, or `None`
+        if it isn't in there (or has changed since it was hashed).
+        """
+        path, size, mtime_ns = self.source_stamp(srcpath)
+        entry = self.source_hashes.get(path)
+        if entry and entry[0] == size and entry[1] == mtime_ns:
+            return bytes.fromhex(entry[2])
+        return None
+
+    def set_source_hash(self, srcpath, src_hash):
+        """Add the hash of a source file to the source hash index."""
+        path, size, mtime_ns = self.source_stamp(srcpath)
+        self.source_hashes[path] = [size, mtime_ns, src_hash.hex()]
+        self.source_hashes_changed = True
+
+    def get_emoji_cache_key(self, emoji, f, license_enabled):
+        """
+        Get the cache key (the file name in the format's cache directory) of
+        an emoji in the format `f`, with or without license, or `None` if
+        that export can't be cached.
         This requires the 'cache_keys' field of the emoji object that is passed
         to be present.
         If `license_enabled` is `True`, then the license type for the given
-        format is used to build the path; if the format `f` does not support a
+        format is used to get the key; if the format `f` does not support a
         license `None` is returned instead.
         """
         if 'cache_keys' not in emoji or 'base' not in emoji['cache_keys']:
@@ -154,55 +311,50 @@ class Cache:
         else:
             cache_key = emoji['cache_keys']['base']
 
-        if cache_key:
-            dir_path = self.build_cache_dir_by_format(f)
-            return os.path.join(dir_path, cache_key)
-        else:
-            return None
+        return cache_key
 
-    def build_cache_dir_by_format(self, f):
+    def get_index(self, f):
         """
-        Checks if the build cache directory for the given format exists,
-        attempting to create it if it doesn't, and returns its path.
+        Get the set of cache keys that are in the cache for the format `f`,
+        listing them if they haven't been yet.
+        The set can be changed by other threads; use in_index() and
+        add_to_index() to look things up in it or add to it.
         """
-        if not self.cache_dir:
-            raise RuntimeError("cache dir not set")
+        with self.index_lock:
+            if f not in self.index:
+                self.index[f] = self.backend.list_keys(f)
 
-        dir_path = os.path.join(self.cache_dir, f)
-        if os.path.isdir(dir_path):
-            # Return immediately if it exists
-            return dir_path
+            return self.index[f]
 
-        if os.path.exists(dir_path):  # Exists but is not directory
-            raise RuntimeError("cache path '{}' exists, but it is not a "
-                               "directory".format(dir_path))
+    def in_index(self, f, cache_key):
+        """Check whether `cache_key` is in the cache for the format `f`."""
+        with self.index_lock:
+            return cache_key in self.get_index(f)
 
-        # Create directory
-        try:
-            os.mkdir(dir_path)
-        except OSError as exc:
-            raise RuntimeError("Cannot create build cache directory "
-                               "'{}'".format(dir_path)) from exc
-
-        return dir_path
+    def add_to_index(self, f, cache_key):
+        """Record that `cache_key` is now in the cache for the format `f`."""
+        with self.index_lock:
+            self.get_index(f).add(cache_key)
 
     def get_cache(self, emoji, f, license_enabled):
         """
-        Get the path to an existing emoji in a given format `f` that is in
+        Get the cache key of an existing emoji in a given format `f` that is in
         cache, or `None` if the cache file does not exist.
         If `license_enabled` is `False`, the cache file for a non-licensed
         export of the format `f` is looked up.
         If `license_enabled` is `True`, the cache file for a licensed export of
         the format `f` is looked up; if `f` does not support a license, `None`
         is returned.
+        This is answered from the cache's index, without touching the disk.
         """
-        cache_file = self.build_emoji_cache_path(emoji, f, license_enabled)
-        if cache_file and os.path.exists(cache_file):
-            return cache_file
+        cache_key = self.get_emoji_cache_key(emoji, f, license_enabled)
+        if cache_key and self.in_index(f, cache_key):
+            return cache_key
 
         return None
 
-    def save_to_cache(self, emoji, f, export_path, license_enabled):
+    def save_to_cache(self, emoji, f, export_path, license_enabled,
+                      editable=False):
         """
         Copy an exported path to the cache directory.
         If `license_enabled` is `False`, the `export_path` will be copied to a
@@ -211,26 +363,35 @@ class Cache:
         cache key for a licensed form of the format `f`; if the format `f` does
         not support a license but `license_enabled` is set, `False` is
         returned.
+        If the exported file is going to be changed after this (`editable`),
+        it's only ever copied or reflinked, never hardlinked.
         """
         if not os.path.exists(export_path):
             raise RuntimeError("Could not find exported emoji '{}' at "
                                "'{}'".format(emoji['short'], export_path))
 
-        cache_file = self.build_emoji_cache_path(emoji, f, license_enabled)
+        cache_key = self.get_emoji_cache_key(emoji, f, license_enabled)
 
-        if cache_file is None:
+        if cache_key is None:
             return False
 
+        start = time.perf_counter()
         try:
-            shutil.copy(export_path, cache_file)
+            size = self.backend.put(f, cache_key, export_path, self.link,
+                                    editable)
         except OSError as exc:
             raise RuntimeError("Unable to save '{}' to cache ('{}'): "
-                               "{}.".format(emoji['short'], cache_file,
+                               "{}.".format(emoji['short'], cache_key,
                                             str(exc)))
 
+        self.count(f, stored=1, stored_bytes=size,
+                   store_time=time.perf_counter() - start)
+
+        self.add_to_index(f, cache_key)
         return True
 
-    def load_from_cache(self, emoji, f, export_path, license_enabled):
+    def load_from_cache(self, emoji, f, export_path, license_enabled,
+                        editable=False):
         """
         Copy an emoji from cache to its final path, `export_path`.
         If `license_enabled` is `False`, the cache for a non-licensed format
@@ -238,22 +399,232 @@ class Cache:
         If `license_enabled` is `True`, the cache for a licensed format `f` is
         looked up and copied if it exists; if `f` does not support a license,
         `False` is returned.
+        If the file at `export_path` is going to be changed after this
+        (`editable`), it's only ever copied or reflinked, so the change can't
+        reach the cache.
         """
         if not self.cache_dir:
             return False
 
-        cache_file = self.get_cache(emoji, f, license_enabled)
-        if not cache_file:
+        cache_key = self.get_cache(emoji, f, license_enabled)
+        if not cache_key:
             return False
 
+        start = time.perf_counter()
         try:
-            shutil.copy(cache_file, export_path)
+            size = self.backend.get(f, cache_key, export_path, self.link,
+                                    editable)
         except OSError as exc:
             raise RuntimeError("Unable to retrieve '{}' from cache ('{}'): "
-                               "{}".format(emoji['short'], cache_file,
+                               "{}".format(emoji['short'], cache_key,
                                            str(exc)))
+
+        self.count(f, restored=1, restored_bytes=size,
+                   restore_time=time.perf_counter() - start)
+        return True
+
+    def count_lookup(self, f, hit):
+        """
+        Count a cache hit (if `hit`) or miss for an emoji in the format `f`.
+        """
+        self.count(f, **{'hits' if hit else 'misses': 1})
+
+    def count(self, f, **amounts):
+        """Add to the statistics of the format `f`."""
+        with self.stats_lock:
+            self.stats[f].update(amounts)
+
+    @staticmethod
+    def render_format(size, renderer):
+        """
+        Get the format name that raw renders at `size` by `renderer` are kept
+        under in the cache.
+        """
+        return f'render-{size}-{renderer}'
+
+    @staticmethod
+    def is_render_format(f):
+        """
+        Check whether `f` is a format raw renders are kept under (see
+        render_format()).
+        """
+        return f.startswith('render-')
+
+    def load_render(self, emoji, size, renderer, dest):
+        """
+        Copy the raw render of an emoji at `size` by `renderer` from the cache
+        to `dest`, if it's there. Returns True if it was.
+        Raw renders are kept by the emoji's base cache key, so formats that
+        weren't exported before can reuse the renders of other formats.
+        An unlicensed png export at `size` is the same file as the render, so
+        it's used as the render when there isn't one of its own (renders
+        aren't saved for the sizes that are exported as png; see
+        ExportExecutor.make_render()).
+        """
+        cache_key = emoji.get('cache_keys', {}).get('base')
+        f = self.render_format(size, renderer)
+        stored_f = None
+        if cache_key:
+            stored_f = next((candidate for candidate in (f, f'png-{size}')
+                             if self.in_index(candidate, cache_key)), None)
+        if stored_f is None:
+            self.count_lookup(f, False)
+            return False
+
+        start = time.perf_counter()
+        try:
+            size = self.backend.get(stored_f, cache_key, dest, self.link)
+        except OSError as exc:
+            raise RuntimeError("Unable to retrieve the render of '{}' from "
+                               "cache ('{}'): {}".format(emoji['short'],
+                                                         cache_key, str(exc)))
+
+        self.count_lookup(f, True)
+        self.count(f, restored=1, restored_bytes=size,
+                   restore_time=time.perf_counter() - start)
         return True
 
+    def save_render(self, emoji, size, renderer, path=None, data=None):
+        """
+        Save the raw render of an emoji at `size` by `renderer` to the cache,
+        from the file at `path`, or from `data` (bytes) if it's in memory.
+        Returns False if the emoji doesn't have cache keys.
+        """
+        cache_key = emoji.get('cache_keys', {}).get('base')
+        if not cache_key:
+            return False
+
+        f = self.render_format(size, renderer)
+        start = time.perf_counter()
+        try:
+            if data is not None:
+                stored_bytes = self.backend.put_data(f, cache_key, data)
+            else:
+                stored_bytes = self.backend.put(f, cache_key, path, self.link)
+        except OSError as exc:
+            raise RuntimeError("Unable to save the render of '{}' to cache "
+                               "('{}'): {}.".format(emoji['short'], cache_key,
+                                                    str(exc)))
+
+        self.count(f, stored=1, stored_bytes=stored_bytes,
+                   store_time=time.perf_counter() - start)
+        self.add_to_index(f, cache_key)
+        return True
+
+    def get_stats(self):
+        """
+        Get the cache's statistics, by format and in total, as a dictionary.
+        Raw renders are counted separately from the exports (under 'renders'
+        and 'renders_total'), since looking one up isn't an export.
+        """
+        formats = {}
+        renders = {}
+        total = collections.Counter()
+        renders_total = collections.Counter()
+        for f, counts in sorted(self.stats.items()):
+            if self.is_render_format(f):
+                renders[f] = dict(counts)
+                renders_total.update(counts)
+            else:
+                formats[f] = dict(counts)
+                total.update(counts)
+
+        return {
+            'formats': formats,
+            'total': dict(total),
+            'renders': renders,
+            'renders_total': dict(renders_total),
+            'key_time': self.key_time,
+        }
+
+    def save_stats(self):
+        """
+        Write the cache's statistics out as JSON to `stats_path` (if the
+        cache has one).
+        """
+        if not self.stats_path:
+            return
+
+        try:
+            with open(self.stats_path, 'w') as f:
+                json.dump(self.get_stats(), f, indent=4, sort_keys=True)
+        except OSError as exc:
+            raise RuntimeError("Unable to write cache statistics to "
+                               "'{}': {}".format(self.stats_path, str(exc)))
+
+    def flush(self):
+        """
+        Write out anything the backend has kept back during the export
+        (ie. when the cache files were used).
+        """
+        self.backend.flush()
+
+    def remove_entries(self, entries):
+        """
+        Remove the given cache files (as from the backend's get_entries())
+        from the cache, returning how many bytes were freed on disk (which
+        for a pack cache is only once their packs are rewritten).
+        """
+        freed = self.backend.remove_entries(entries)
+        with self.index_lock:
+            for f, cache_key, _, _ in entries:
+                if f in self.index:
+                    self.index[f].discard(cache_key)
+        return freed
+
+    def evict(self):
+        """
+        Remove the files used longest ago from the cache until it's no
+        bigger than its `max_size`. Returns how many files were removed and
+        how many bytes that freed.
+        """
+        if not self.max_size:
+            return 0, 0
+
+        entries = self.backend.get_entries()
+        total = sum(size for _, _, size, _ in entries)
+
+        evicted = []
+        for entry in sorted(entries, key=lambda entry: entry[3]):
+            if total <= self.max_size:
+                break
+            evicted.append(entry)
+            total -= entry[2]
+
+        return len(evicted), self.remove_entries(evicted)
+
+    def gc(self, manifest, emoji, input_path):
+        """
+        Remove every file from the cache that isn't pointed to by any cache
+        key (with or without license) of the given emoji of the manifest.
+        Returns how many files were removed and how many bytes that freed.
+        """
+        keys = set()
+        for e in emoji:
+            if 'src' not in e:
+                continue
+
+            srcpath = os.path.join(manifest.homedir, input_path, e['src'])
+            try:
+                with open(srcpath, 'r') as f:
+                    emoji_src = f.read()
+            except (OSError, UnicodeDecodeError):
+                # (without a source, nothing points at this emoji's files.)
+                continue
+
+            emoji_keys = self.get_cache_keys(e, manifest, emoji_src, True,
+                                             srcpath)
+            # (nothing's exported, so the translated SVG isn't needed.)
+            svg.forget_translated_color(e)
+            keys.add(emoji_keys['base'])
+            keys.update(emoji_keys['licenses'].values())
+
+        self.save_source_hashes()
+
+        garbage = [entry for entry in self.backend.get_entries()
+                   if entry[1] not in keys]
+        return len(garbage), self.remove_entries(garbage)
+
     @classmethod
     def filter_cacheable_formats(cls, fs, license_enabled):
         """
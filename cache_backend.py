@@ -0,0 +1,746 @@
+import collections
+import contextlib
+import mmap
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import files
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+
+"""
+What format names and cache keys can look like (so they can't point
+outside of the cache when they're used in a path or URL).
+"""
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9._-]*$')
+
+"""
+What the formats orxporter caches look like: svg, a raster format and size
+(ie. png-64) or a raw render (ie. render-64-resvg).
+"""
+FORMAT_PATTERN = re.compile(r'^(svg|[a-z]+-\d+|render-\d+-[a-z-]+)$')
+
+
+
+def get_backend(location, pack=False):
+    """
+    Makes the backend for a cache location, which is either the URL of a
+    cache server (http:// or https://) or a directory. A directory cache
+    is kept in pack files if `pack` is set, or if it already has them.
+    """
+    if re.match(r'^https?://', location):
+        return HttpBackend(location)
+    if pack or os.path.isdir(os.path.join(location, PackBackend.pack_dir_name)):
+        return PackBackend(location)
+    return DirectoryBackend(location)
+
+
+
+def check_name(name):
+    """
+    Raises a ValueError if `name` can't be a format name or cache key.
+    """
+    if not NAME_PATTERN.match(name):
+        raise ValueError(f"'{name}' can't be used as a name in the cache.")
+
+
+
+def check_format(f):
+    """
+    Raises a ValueError if `f` isn't a format orxporter would cache.
+    """
+    if not FORMAT_PATTERN.match(f):
+        raise ValueError(f"'{f}' isn't a format orxporter caches.")
+
+
+
+class CacheBackend:
+    """
+    Where a Cache keeps its files. Every file is stored by the format it
+    was exported to and its cache key.
+
+    A backend can also keep small metadata files (ie. the source hash index)
+    by name. Backends that aren't `local` don't have to support listing
+    (get_entries()) or removing (remove_entries()) files, which are only
+    used to clean a cache up.
+    """
+
+    local = True
+
+    def list_keys(self, f):
+        """Gets the set of cache keys stored for the format `f`."""
+        raise NotImplementedError
+
+    def exists(self, f, key):
+        """Returns True if a file is stored for this format and key."""
+        raise NotImplementedError
+
+    def get(self, f, key, dest, link='copy', editable=False):
+        """
+        Puts the file stored for this format and key at `dest` (by the
+        `link` method where the backend can do that; see files.link_file()).
+        Returns its size in bytes.
+        """
+        raise NotImplementedError
+
+    def put(self, f, key, src, link='copy', editable=False):
+        """
+        Stores the file at `src` for this format and key. Returns its size
+        in bytes.
+        """
+        raise NotImplementedError
+
+    def put_data(self, f, key, data):
+        """
+        Stores `data` (bytes) as the file for this format and key. Returns
+        its size in bytes.
+        """
+        raise NotImplementedError
+
+    def read_meta(self, name):
+        """
+        Gets the text of a metadata file, or None if there isn't one.
+        """
+        return None
+
+    def write_meta(self, name, text):
+        """Writes a metadata file."""
+        pass
+
+    def flush(self):
+        """
+        Writes out anything the backend has kept back until the end of an
+        export (ie. when files were last used).
+        """
+        pass
+
+    def get_entries(self):
+        """
+        Gets every stored file as (format, cache key, size, last used time)
+        tuples.
+        """
+        raise ValueError(f"The cache at '{self.location}' can't be listed, "
+                         "so it can only be cleaned up by its server.")
+
+    def remove_entries(self, entries):
+        """
+        Removes the given files (as from get_entries()), returning how many
+        bytes were freed.
+        """
+        raise ValueError(f"Files can't be removed from the cache at "
+                         f"'{self.location}', so it can only be cleaned up "
+                         "by its server.")
+
+
+
+class DirectoryBackend(CacheBackend):
+    """
+    Keeps the cache in a directory, with a directory for each format that
+    has a file for every cache key.
+
+    Files are written atomically (by renaming a temporary file into place),
+    so several orxporters can share a cache directory. Getting a file
+    updates its modification time, which is what eviction goes by.
+    """
+
+    # How old (in seconds) a temporary file in the cache has to be before
+    # it's treated as left behind
+    temp_file_max_age = 60 * 60
+
+    def __init__(self, cache_dir):
+        self.location = cache_dir
+        self.cache_dir = cache_dir
+        self.format_dirs = set()
+        self.initiate_cache_dir()
+
+    def initiate_cache_dir(self):
+        """Make the cache directory if it does not exist already."""
+        if not os.path.exists(self.cache_dir):
+            try:
+                # (another orxporter might be making it at the same time.)
+                os.makedirs(self.cache_dir, exist_ok=True)
+            except OSError as exc:
+                raise RuntimeError("Cannot create cache directory "
+                                   "'{}'".format(self.cache_dir)) from exc
+        elif not os.path.isdir(self.cache_dir):
+            raise RuntimeError("Cache path '{}' exists but is not a "
+                               "directory".format(self.cache_dir))
+
+        return True
+
+    def build_cache_dir_by_format(self, f):
+        """
+        Checks if the build cache directory for the given format exists,
+        attempting to create it if it doesn't, and returns its path.
+        """
+        check_name(f)
+        dir_path = os.path.join(self.cache_dir, f)
+        if f in self.format_dirs:
+            # Return immediately if it's been checked already
+            return dir_path
+
+        if os.path.exists(dir_path) and not os.path.isdir(dir_path):
+            raise RuntimeError("cache path '{}' exists, but it is not a "
+                               "directory".format(dir_path))
+
+        # Create directory
+        # (another orxporter sharing the cache might be making it too.)
+        try:
+            os.makedirs(dir_path, exist_ok=True)
+        except OSError as exc:
+            raise RuntimeError("Cannot create build cache directory "
+                               "'{}'".format(dir_path)) from exc
+
+        self.format_dirs.add(f)
+        return dir_path
+
+    def path(self, f, key, make_dir=False):
+        """
+        Gets the path of the file for this format and key, making the
+        format's directory first if `make_dir` is set.
+        """
+        check_name(f)
+        check_name(key)
+        if make_dir:
+            return os.path.join(self.build_cache_dir_by_format(f), key)
+        return os.path.join(self.cache_dir, f, key)
+
+    def list_keys(self, f):
+        check_name(f)
+        dir_path = os.path.join(self.cache_dir, f)
+
+        # (nothing's been stored in this format yet; the directory is only
+        # made once something is.)
+        if not os.path.isdir(dir_path):
+            return set()
+
+        try:
+            # (files starting with a dot are other orxporters'
+            # temporary files.)
+            with os.scandir(dir_path) as entries:
+                return set(entry.name for entry in entries
+                           if entry.is_file()
+                           and not entry.name.startswith('.'))
+        except OSError as exc:
+            raise RuntimeError("Cannot read build cache directory "
+                               "'{}'".format(dir_path)) from exc
+
+    def exists(self, f, key):
+        return os.path.isfile(self.path(f, key))
+
+    def get(self, f, key, dest, link='copy', editable=False):
+        cache_file = self.path(f, key)
+        files.link_file(cache_file, dest, link, editable)
+
+        # mark it as recently used (this is what eviction goes by)
+        try:
+            os.utime(cache_file)
+        except OSError:
+            pass
+
+        return os.path.getsize(cache_file)
+
+    def put(self, f, key, src, link='copy', editable=False):
+        cache_file = self.path(f, key, make_dir=True)
+
+        # (the cache has to keep its own files, so it's never symlinked to
+        # an export.)
+        if link == 'symlink':
+            link = 'hardlink'
+
+        # (written to a temporary file that's renamed into place, so that
+        # other orxporters sharing the cache never see half a file.)
+        files.write_atomic(cache_file, lambda temp_path:
+                           files.link_file(src, temp_path, link, editable))
+        return os.path.getsize(cache_file)
+
+    def put_data(self, f, key, data):
+        def write(temp_path):
+            with open(temp_path, 'wb') as out:
+                out.write(data)
+
+        files.write_atomic(self.path(f, key, make_dir=True), write)
+        return len(data)
+
+    def read_meta(self, name):
+        path = os.path.join(self.cache_dir, name)
+        try:
+            with open(path, 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write_meta(self, name, text):
+        def write(temp_path):
+            with open(temp_path, 'w') as f:
+                f.write(text)
+
+        files.write_atomic(os.path.join(self.cache_dir, name), write)
+
+    def get_entries(self):
+        entries = []
+        with os.scandir(self.cache_dir) as format_dirs:
+            for format_dir in format_dirs:
+                # (directories starting with a dot aren't formats.)
+                if not format_dir.is_dir() or format_dir.name.startswith('.'):
+                    continue
+                with os.scandir(format_dir.path) as cache_files:
+                    for cache_file in cache_files:
+                        if not cache_file.is_file(follow_symlinks=False):
+                            continue
+                        st = cache_file.stat(follow_symlinks=False)
+
+                        # leave temporary files alone, unless they were left
+                        # behind by an orxporter that was stopped.
+                        if (cache_file.name.startswith('.') and
+                                time.time() - st.st_mtime < self.temp_file_max_age):
+                            continue
+
+                        entries.append((format_dir.name, cache_file.name,
+                                        st.st_size, st.st_mtime))
+        return entries
+
+    def remove_entries(self, entries):
+        freed = 0
+        for f, key, size, _ in entries:
+            try:
+                os.remove(os.path.join(self.cache_dir, f, key))
+            except FileNotFoundError:
+                pass
+            except OSError as exc:
+                raise RuntimeError("Unable to remove '{}' from cache: "
+                                   "{}".format(key, str(exc)))
+            freed += size
+        return freed
+
+
+
+class PackBackend(DirectoryBackend):
+    """
+    Keeps the cache in a few big pack files (in the '.packs' directory of the
+    cache directory) instead of a file for every export, which would be
+    millions of tiny files for a big emoji set in a lot of formats.
+
+    New files are appended to the newest pack, and an entry for each one is
+    appended to the pack index ('.packs/index'), as a line of:
+        <format> <cache key> <pack number> <offset> <size> <time stored> <time used>
+    If a key is in the index more than once, the last entry is the one used.
+    The times files were used are kept in memory and appended to the index
+    as new entries once per export (see flush()), and the index is
+    rewritten without the old entries once there are a lot of them.
+    Changes are made under a lock file, so several orxporters can share a
+    pack cache (each only sees the files the others stored before it
+    started, until it reads the index again).
+
+    Files are read from memory-mapped packs. They're always written out as
+    new files, so the cache can't be changed through them. Removing files
+    only takes them out of the index; a pack is only rewritten (by moving
+    the files that are left in it to the newest pack, and deleting it) once
+    most of it is removed files. If that's the newest pack, a new one is
+    started for them. Packs are never changed in place and their numbers
+    are never used again, so a reader whose pack has been deleted just
+    reads the index again.
+    """
+
+    pack_dir_name = '.packs'
+
+    # Size (in bytes) a pack can grow to before a new one is started
+    max_pack_size = 256 * 1024 ** 2
+
+    # How much of a pack (as a fraction of its size) has to be removed
+    # files before it's rewritten
+    compact_ratio = 0.5
+
+    # How many more lines the index can have than it has files before
+    # it's rewritten
+    index_slack = 1024
+
+    def __init__(self, cache_dir):
+        super().__init__(cache_dir)
+        self.pack_dir = os.path.join(cache_dir, self.pack_dir_name)
+        self.index_path = os.path.join(self.pack_dir, 'index')
+        self.lock_path = os.path.join(self.pack_dir, 'lock')
+        os.makedirs(self.pack_dir, exist_ok=True)
+
+        # (the export's threads use the backend at the same time, so
+        # `entries` and `maps` are only ever looked at or changed with this
+        # held. The lock file is only taken with it held too, so it's never
+        # taken twice by the same orxporter.)
+        self.thread_lock = threading.RLock()
+        self.maps = {}
+        self.used = {}
+        self.index_lines = 0
+        self.entries = self.load_index()
+
+    def pack_path(self, pack):
+        """Gets the path of the pack with the number `pack`."""
+        return os.path.join(self.pack_dir, f'pack-{pack:04d}.pack')
+
+    def load_index(self):
+        """
+        Reads the pack index, returning a dictionary of (format, cache key):
+        (pack number, offset, size, time stored, time used).
+        """
+        entries = {}
+        self.index_lines = 0
+        try:
+            with open(self.index_path, 'r') as index:
+                for line in index:
+                    self.index_lines += 1
+                    try:
+                        fields = line.split()
+                        # (indexes from before files were touched when
+                        # used don't have the time used.)
+                        if len(fields) == 6:
+                            fields.append(fields[5])
+                        f, key, pack, offset, size, stored, used = fields
+                        entries[(f, key)] = (int(pack), int(offset), int(size),
+                                             float(stored), float(used))
+                    except ValueError:
+                        # (the last line might be half-written if an
+                        # orxporter was stopped while writing it.)
+                        continue
+        except FileNotFoundError:
+            pass
+        return entries
+
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        Holds the pack lock (between threads, and between processes where
+        the platform can do that).
+        """
+        with self.thread_lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def newest_pack(self):
+        """Gets the number of the newest pack (0 if there aren't any)."""
+        packs = [int(name[5:-5]) for name in os.listdir(self.pack_dir)
+                 if re.match(r'^pack-\d+\.pack$', name)]
+        return max(packs, default=0)
+
+    def list_keys(self, f):
+        with self.thread_lock:
+            keys = list(self.entries)
+        return set(key for entry_f, key in keys if entry_f == f)
+
+    def exists(self, f, key):
+        with self.thread_lock:
+            return (f, key) in self.entries
+
+    def read_entry(self, entry):
+        """
+        Gets the contents of the file an index entry points at.
+        Raises FileNotFoundError if its pack isn't there anymore.
+        """
+        pack, offset, size, _, _ = entry
+
+        with self.thread_lock:
+            mapped = self.maps.get(pack)
+            if mapped is None or len(mapped) < offset + size:
+                # (map the pack again if it's grown since it was mapped.)
+                with open(self.pack_path(pack), 'rb') as pack_file:
+                    mapped = mmap.mmap(pack_file.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+                if pack in self.maps:
+                    self.maps[pack].close()
+                self.maps[pack] = mapped
+
+            return mapped[offset:offset + size]
+
+    def read(self, f, key):
+        """Gets the contents of the file for this format and key."""
+        with self.thread_lock:
+            entry = self.entries[(f, key)]
+
+        try:
+            return self.read_entry(entry)
+        except FileNotFoundError:
+            # another orxporter has rewritten the pack since the index was
+            # read, so the file has moved to another pack.
+            with self.locked():
+                self.entries = self.load_index()
+                return self.read_entry(self.entries[(f, key)])
+
+    def get(self, f, key, dest, link='copy', editable=False):
+        data = self.read(f, key)
+
+        def write(temp_path):
+            with open(temp_path, 'wb') as out:
+                out.write(data)
+
+        # (written out as a new file, in case `dest` is linked to something.)
+        files.write_atomic(dest, write)
+
+        # mark it as recently used, for --cache-max-size. (This is only
+        # written to the index by flush().)
+        with self.thread_lock:
+            self.used[(f, key)] = time.time()
+        return len(data)
+
+    def put(self, f, key, src, link='copy', editable=False):
+        with open(src, 'rb') as fsrc:
+            return self.put_data(f, key, fsrc.read())
+
+    def put_data(self, f, key, data):
+        check_name(f)
+        check_name(key)
+
+        with self.locked():
+            now = time.time()
+            pack, offset = self.append_data(data)
+            self.append_entries({(f, key): (pack, offset, len(data), now, now)})
+        return len(data)
+
+    def append_data(self, data):
+        """
+        Appends data to the newest pack (starting a new one if it's full),
+        returning the number of the pack and the offset it's at.
+        (Only with the pack lock held.)
+        """
+        pack = max(self.newest_pack(), 1)
+        if (os.path.exists(self.pack_path(pack)) and
+                os.path.getsize(self.pack_path(pack)) >= self.max_pack_size):
+            pack += 1
+
+        with open(self.pack_path(pack), 'ab') as pack_file:
+            offset = pack_file.tell()
+            pack_file.write(data)
+        return pack, offset
+
+    def flush(self):
+        """
+        Writes the times files were used since the last flush to the index.
+        """
+        with self.locked():
+            if not self.used:
+                return
+            # (the entries could have been moved or replaced by other
+            # orxporters since this one read the index.)
+            self.entries = self.load_index()
+            touched = {}
+            for (f, key), used in self.used.items():
+                entry = self.entries.get((f, key))
+                if entry is not None and entry[4] < used:
+                    touched[(f, key)] = entry[:4] + (used, )
+            self.used = {}
+            self.append_entries(touched)
+
+    def append_entries(self, entries):
+        """
+        Adds entries to the index, rewriting it without the entries that
+        have been replaced if it's grown too long.
+        (Only with the pack lock held, after the data they point at has
+        been written, so the index never points at something that isn't
+        there.)
+        """
+        with open(self.index_path, 'a') as index:
+            for (f, key), entry in entries.items():
+                index.write(self.format_entry(f, key, entry))
+        self.entries.update(entries)
+        self.index_lines += len(entries)
+
+        if self.index_lines > len(self.entries) * 2 + self.index_slack:
+            # (include what other orxporters have added since this one
+            # read the index.)
+            self.entries = self.load_index()
+            self.rewrite_index()
+
+    def rewrite_index(self):
+        """
+        Writes the whole index out again from `entries`.
+        (Only with the pack lock held.)
+        """
+        files.write_atomic(self.index_path, lambda temp_path:
+                           self.write_index(temp_path, self.entries))
+        self.index_lines = len(self.entries)
+
+    @staticmethod
+    def format_entry(f, key, entry):
+        """Formats an entry as a line of the pack index."""
+        pack, offset, size, stored, used = entry
+        return f'{f} {key} {pack} {offset} {size} {stored:.3f} {used:.3f}\n'
+
+    def get_entries(self):
+        # (read the index again, for the files other orxporters have used.)
+        self.flush()
+        with self.locked():
+            self.entries = self.load_index()
+            entries = list(self.entries.items())
+        return [(f, key, size, used)
+                for (f, key), (_, _, size, _, used) in entries]
+
+    def remove_entries(self, entries):
+        if not entries:
+            return 0
+
+        # (files only take up less space once their pack is rewritten,
+        # so this is what compact() freed rather than their sizes.)
+        with self.locked():
+            self.entries = self.load_index()
+            for f, key, _, _ in entries:
+                self.entries.pop((f, key), None)
+                self.used.pop((f, key), None)
+            self.rewrite_index()
+            return self.compact()
+
+    def compact(self):
+        """
+        Rewrites the packs that are mostly removed files, by moving the
+        files that are left in them to the newest pack (or a new one, if
+        the newest pack is being rewritten) and deleting them. Returns how
+        many bytes that freed.
+        (Only with the pack lock held.)
+        """
+        live = collections.Counter()
+        for pack, _, size, _, _ in self.entries.values():
+            live[pack] += size
+
+        newest = self.newest_pack()
+        dead_packs = {}
+        for pack in range(1, newest + 1):
+            try:
+                pack_size = os.path.getsize(self.pack_path(pack))
+            except FileNotFoundError:
+                continue
+            if pack_size - live[pack] > pack_size * self.compact_ratio:
+                dead_packs[pack] = pack_size
+
+        if not dead_packs:
+            return 0
+
+        # (the new pack is made straight away, so its number can't be
+        # given to another pack if nothing gets moved to it.)
+        if newest in dead_packs:
+            open(self.pack_path(newest + 1), 'ab').close()
+
+        freed = sum(dead_packs.values())
+        moved = {}
+        for (f, key), entry in self.entries.items():
+            if entry[0] in dead_packs:
+                pack, offset = self.append_data(self.read_entry(entry))
+                moved[(f, key)] = (pack, offset) + entry[2:]
+                freed -= entry[2]
+
+        # (the index points at the new places before the old packs go.)
+        self.entries.update(moved)
+        self.rewrite_index()
+        for pack in dead_packs:
+            if pack in self.maps:
+                self.maps.pop(pack).close()
+            os.remove(self.pack_path(pack))
+        return freed
+
+    def write_index(self, path, entries):
+        """Writes a whole pack index out to `path`."""
+        with open(path, 'w') as index:
+            for (f, key), entry in entries.items():
+                index.write(self.format_entry(f, key, entry))
+
+
+
+class HttpBackend(CacheBackend):
+    """
+    Keeps the cache on an HTTP server (like cache_server.py), which stores
+    a file for every format and cache key:
+
+    - GET <url>/<format>/ lists the cache keys of a format, one per line;
+    - GET <url>/<format>/<key> gets a file (404 if it isn't there);
+    - HEAD <url>/<format>/<key> checks if a file is there;
+    - PUT <url>/<format>/<key> stores a file.
+
+    Files from the server are always written out as new files, so the
+    cache can't be changed through them.
+    """
+
+    local = False
+
+    # How long (in seconds) to wait for the server
+    timeout = 60
+
+    def __init__(self, url):
+        self.location = url
+        self.url = url.rstrip('/')
+
+    def build_url(self, f, key=''):
+        """Gets the URL of the file for this format and key."""
+        check_name(f)
+        if key:
+            check_name(key)
+        return f'{self.url}/{urllib.parse.quote(f)}/{urllib.parse.quote(key)}'
+
+    def request(self, url, method='GET', data=None):
+        """
+        Makes a request to the cache server, returning the response (which
+        has to be closed), or None if the server said it isn't there (404).
+        """
+        req = urllib.request.Request(url, data=data, method=method)
+        try:
+            return urllib.request.urlopen(req, timeout=self.timeout)
+        except urllib.error.HTTPError as exc:
+            if exc.code == 404:
+                return None
+            raise RuntimeError(f"The cache server returned an error for "
+                               f"'{url}': {exc.code} {exc.reason}") from exc
+        except (urllib.error.URLError, OSError) as exc:
+            raise RuntimeError(f"Could not reach the cache server at "
+                               f"'{self.url}': {exc}") from exc
+
+    def list_keys(self, f):
+        res = self.request(self.build_url(f))
+        if res is None:
+            return set()
+        with res:
+            return set(line for line in res.read().decode('utf-8').splitlines()
+                       if line)
+
+    def exists(self, f, key):
+        res = self.request(self.build_url(f, key), 'HEAD')
+        if res is None:
+            return False
+        res.close()
+        return True
+
+    def get(self, f, key, dest, link='copy', editable=False):
+        url = self.build_url(f, key)
+        res = self.request(url)
+        if res is None:
+            raise RuntimeError(f"'{url}' isn't on the cache server anymore.")
+
+        with res:
+            data = res.read()
+
+        def write(temp_path):
+            with open(temp_path, 'wb') as out:
+                out.write(data)
+
+        files.write_atomic(dest, write)
+        return len(data)
+
+    def put(self, f, key, src, link='copy', editable=False):
+        with open(src, 'rb') as fsrc:
+            return self.put_data(f, key, fsrc.read())
+
+    def put_data(self, f, key, data):
+        url = self.build_url(f, key)
+        res = self.request(url, 'PUT', data)
+        if res is None:
+            raise RuntimeError(f"The cache server doesn't take files at '{url}'.")
+        res.close()
+        return len(data)
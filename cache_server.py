@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+A small reference cache server, that keeps an orxporter cache in a
+directory and serves it over HTTP, so that several machines can share
+one cache (use its URL as orxporter's -C, ie. 'http://buildhost:8765').
+
+It's meant for testing and for trusted networks; there's no
+authentication, so anyone who can reach it can add files to the cache.
+
+USAGE: cache_server.py [-H HOST] [-p PORT] <cache directory>
+       (default: localhost, port 8765)
+"""
+
+import getopt
+import http.server
+import os
+import sys
+import urllib.parse
+
+from cache_backend import DirectoryBackend, check_format, check_name
+
+
+
+class CacheRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles the requests of HttpBackend (see there) against the
+    DirectoryBackend of the server.
+    """
+
+    backend = None
+
+    def parse_path(self):
+        """
+        Gets the format and cache key (which is '' for a listing) of the
+        request, or sends an error and returns None if it's not valid.
+        """
+        parts = urllib.parse.unquote(urllib.parse.urlparse(self.path).path).split('/')
+        if len(parts) != 3 or parts[0] != '':
+            self.send_error(404)
+            return None
+
+        _, f, key = parts
+        try:
+            check_format(f)
+            if key:
+                check_name(key)
+        except ValueError:
+            self.send_error(400)
+            return None
+        return f, key
+
+    def send_data(self, data, head=False):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(data)
+
+    def do_GET(self, head=False):
+        parsed = self.parse_path()
+        if parsed is None:
+            return
+        f, key = parsed
+
+        if not key:
+            keys = sorted(self.backend.list_keys(f))
+            self.send_data(''.join(k + '\n' for k in keys).encode('utf-8'), head)
+            return
+
+        if not self.backend.exists(f, key):
+            self.send_error(404)
+            return
+
+        path = self.backend.path(f, key)
+        with open(path, 'rb') as cache_file:
+            data = cache_file.read()
+        if not head:
+            # mark it as recently used, for cleaning the cache up with
+            # orxporter's --cache-max-size.
+            os.utime(path)
+        self.send_data(data, head)
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_PUT(self):
+        parsed = self.parse_path()
+        if parsed is None:
+            return
+        f, key = parsed
+        if not key:
+            self.send_error(405)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        self.backend.put_data(f, key, self.rfile.read(length))
+        self.send_data(b'')
+
+
+
+def main():
+    host = 'localhost'
+    port = 8765
+
+    opts, args = getopt.getopt(sys.argv[1:], 'H:p:')
+    for opt, arg in opts:
+        if opt == '-H':
+            host = arg
+        elif opt == '-p':
+            port = int(arg)
+
+    if len(args) != 1:
+        print(__doc__)
+        sys.exit(2)
+
+    CacheRequestHandler.backend = DirectoryBackend(args[0])
+    server = http.server.ThreadingHTTPServer((host, port), CacheRequestHandler)
+    print(f"Serving the cache in '{args[0]}' on http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+
+if __name__ == '__main__':
+    main()
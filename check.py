@@ -2,11 +2,13 @@ import os
 
 from dest_paths import format_path, format_resolve
 from exception import FilterException
+import shard as sharding
 import svg
 import log
 
 def emoji(m, filtered_emoji, input_path, formats, path, src_size,
-           num_threads, renderer, max_batch, cache, license_enabled, verbose):
+           num_threads, renderer, max_batch, cache, license_enabled, verbose,
+           shard=None, sources=None):
     """
     Checks all emoji in a very light validation as well as checking if emoji
     aren't filtered out by user choices.
@@ -23,9 +25,16 @@ def emoji(m, filtered_emoji, input_path, formats, path, src_size,
     - If the svg size is consistent (if a -q flag is used).
       (Will throw an Exception if not the case.)
 
+    If a `shard` is given (as (K, N)), only the emoji in that shard of the
+    ones that aren't filtered out are checked and exported.
+
+    If a SourceStore is given as `sources`, the source SVGs are read into
+    it (on `num_threads` threads), so they don't have to be read again
+    when they're exported.
+
     It this doesn't result in an Exception, it returns dict containing
     a list of emoji that aren't filtered out, as well as a count
-    of emoji that were skipped.
+    of emoji that were skipped (and the count that are in other shards).
     """
 
     exporting_emoji = []
@@ -35,20 +44,36 @@ def emoji(m, filtered_emoji, input_path, formats, path, src_size,
     }
     cached_emoji_count = 0  # Required to give a correct count without overlap
     skipped_emoji_count = 0
+    other_shard_emoji_count = 0
 
-    for i, e in enumerate(filtered_emoji):
-
-        short = e.get("short", "<UNNAMED>") # to provide info on possible error printouts
-
+    checking_emoji = []
+    for e in filtered_emoji:
         try:
             format_path(path, e, 'svg')
 
         except FilterException as ex:
             if verbose:
-                log.out(f"- - Skipped emoji: {short} - {ex}", 34)
+                log.out(f"- - Skipped emoji: {e.get('short', '<UNNAMED>')} - {ex}", 34)
             skipped_emoji_count += 1
             continue # skip if filtered out
 
+        checking_emoji.append(e)
+
+    # only keep this shard's emoji (if this export is sharded)
+    if shard:
+        shard_emoji = sharding.partition(m, input_path, checking_emoji, formats, shard)
+        other_shard_emoji_count = len(checking_emoji) - len(shard_emoji)
+        checking_emoji = shard_emoji
+
+    # read all of the source SVGs at once
+    if sources is not None:
+        sources.prefetch([os.path.join(m.homedir, input_path, e['src'])
+                          for e in checking_emoji if 'src' in e], num_threads)
+
+    for e in checking_emoji:
+
+        short = e.get("short", "<UNNAMED>") # to provide info on possible error printouts
+
         if 'src' not in e:
             raise ValueError(f"The emoji '{short}' is missing an 'src' attribute. It needs to have one.")
 
@@ -57,7 +82,10 @@ def emoji(m, filtered_emoji, input_path, formats, path, src_size,
         # try to see if the source SVG file exists
         srcpath = os.path.join(m.homedir, input_path, e['src'])
         try:
-            emoji_svg = open(srcpath, 'r').read()
+            if sources is not None:
+                emoji_svg = sources.read(srcpath)
+            else:
+                emoji_svg = open(srcpath, 'r').read()
         except Exception:
             raise ValueError(f"This source image for emoji '{short}' could not be loaded: {srcpath}")
 
@@ -79,7 +107,7 @@ def emoji(m, filtered_emoji, input_path, formats, path, src_size,
         if cache:
             # prime the cache keys in the emoji for later
             emoji_cache_keys = cache.get_cache_keys(e, m, emoji_svg,
-                                                    license_enabled)
+                                                    license_enabled, srcpath)
             e['cache_keys'] = emoji_cache_keys
 
             # check if the emoji is in cache
@@ -105,6 +133,9 @@ def emoji(m, filtered_emoji, input_path, formats, path, src_size,
                     else:
                         formats_status['no_cache'].append(f)
 
+            for f in formats:
+                cache.count_lookup(f, f not in formats_status['no_cache'])
+
             # Assign the formats to their cache status and export bins
             if formats_status['licensed_export']:
                 cached_emoji['licensed_exports'].append((e, formats_status['licensed_export']))
@@ -117,14 +148,23 @@ def emoji(m, filtered_emoji, input_path, formats, path, src_size,
 
             if formats_status['no_cache']:
                 exporting_emoji.append((e, formats_status['no_cache']))
+            else:
+                # (nothing of it is exported, so its translated SVG won't
+                # be needed.)
+                svg.forget_translated_color(e)
 
         else:
             # add the emoji to exporting_emoji if it's passed all the tests.
             # Cache is not enabled; pass all formats to exporting.
             exporting_emoji.append((e, formats))
 
+    # keep the hashes of the sources for the next export
+    if cache:
+        cache.save_source_hashes()
+
     return { "exporting_emoji" : exporting_emoji
            , "skipped_emoji_count" : skipped_emoji_count
+           , "other_shard_emoji_count" : other_shard_emoji_count
            , "cached_emoji": cached_emoji
            , "cached_emoji_count": cached_emoji_count
            }
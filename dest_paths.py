@@ -99,7 +99,7 @@ def format_path(path, emoji, format):
     elif format.startswith('jxl-'):
         res = res + '.jxl'
     else:
-        raise ValueError('Invalid export format: ' + FilterException)
+        raise ValueError('Invalid export format: ' + format)
 
     # - catch instances of % in the output file path
     # - uses format_resolve() to figure out what it is
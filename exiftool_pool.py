@@ -0,0 +1,217 @@
+import concurrent.futures
+import math
+import os
+import queue
+import subprocess
+
+
+
+class ExifToolProcess:
+    """
+    A single long-lived exiftool process (`exiftool -stay_open True -@ -`),
+    that batches of files can be sent to for adding metadata.
+
+    The tag arguments are given to the process once when it starts, so
+    this saves starting Perl and parsing them again for every batch. If the
+    process dies, it is restarted for the next batch.
+    """
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.proc = None
+        self.execute_count = 0
+
+
+    def start(self):
+        """
+        Starts the exiftool process.
+        """
+        # (stderr goes to the same pipe as stdout, so that the errors of
+        # each batch come before the message that says it's done.)
+        cmd = ['exiftool', '-stay_open', 'True', '-@', '-',
+               '-common_args', '-overwrite_original']
+        for tag, val in self.metadata.items():
+            cmd.append('-{}={}'.format(tag, val))
+
+        try:
+            self.proc = subprocess.Popen(cmd,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.STDOUT)
+        except Exception as e:
+            raise Exception('Invoking the EXIF metadata embedding tool (exiftool) failed: ' + str(e))
+
+
+    def stop(self):
+        """
+        Asks the exiftool process to quit (or kills it if it won't).
+        """
+        if self.proc is None:
+            return
+
+        try:
+            self.proc.stdin.write(b'-stay_open\nFalse\n')
+            self.proc.stdin.flush()
+            self.proc.wait(timeout=5)
+        except Exception:
+            self.proc.kill()
+            self.proc.wait()
+
+        self.proc = None
+
+
+    def alive(self):
+        """
+        Returns True if the exiftool process is running.
+        """
+        return self.proc is not None and self.proc.poll() is None
+
+
+    def execute(self, paths):
+        """
+        Runs exiftool on the files at `paths` and returns its output lines
+        (without the '{readyN}' line exiftool ends them with).
+        """
+        self.execute_count += 1
+        ready = f'{{ready{self.execute_count}}}'
+
+        args = [os.path.abspath(p) for p in paths]
+        args.append(f'-execute{self.execute_count}')
+        for arg in args:
+            if '\n' in arg:
+                raise ValueError(f"exiftool can't be given '{arg}', because it has a line break in it.")
+
+        self.proc.stdin.write(''.join(arg + '\n' for arg in args).encode('utf-8'))
+        self.proc.stdin.flush()
+
+        lines = []
+        while True:
+            line = self.proc.stdout.readline()
+            if not line:
+                raise Exception('exiftool stopped unexpectedly (returned '
+                                f'{self.proc.poll()})')
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+            if line == ready:
+                return lines
+            lines.append(line)
+
+
+    def add_metadata(self, paths):
+        """
+        Adds the metadata to the files at `paths`, (re)starting exiftool if
+        needed.
+
+        Returns a dict of path: error message for every file that exiftool
+        couldn't change.
+        """
+        if not self.alive():
+            self.start()
+
+        try:
+            lines = self.execute(paths)
+            if not has_errors(lines):
+                return {}
+            if len(paths) == 1:
+                return {paths[0]: error_message(lines)}
+
+            # something went wrong, so go through the files one at a time to
+            # find out which ones it was.
+            failed = {}
+            for path in paths:
+                lines = self.execute([path])
+                if has_errors(lines):
+                    failed[path] = error_message(lines)
+            return failed
+
+        except Exception:
+            # the process has crashed or stopped talking to us;
+            # get rid of it so that the next batch starts a new one.
+            self.stop()
+            raise
+
+
+
+def has_errors(lines):
+    """
+    Returns True if exiftool's output says that something wasn't changed
+    because of an error.
+    """
+    return any(line.startswith('Error') or "weren't updated" in line
+               for line in lines)
+
+
+
+def error_message(lines):
+    """
+    Gets the error message out of exiftool's output for a single file.
+    """
+    errors = [line for line in lines if line.startswith('Error')]
+    return '; '.join(errors) or 'exiftool did not update it'
+
+
+
+class ExifToolPool:
+    """
+    A fixed number of ExifToolProcesses that adds metadata to batches of
+    files, with every process working on a batch at the same time.
+    """
+
+    def __init__(self, size, metadata):
+        self.size = size
+        self.processes = queue.Queue()
+        self.all_processes = []
+
+        for i in range(size):
+            process = ExifToolProcess(metadata)
+            self.all_processes.append(process)
+            self.processes.put(process)
+
+
+    def add_metadata_batch(self, batch):
+        """
+        Adds the metadata to a single batch of files with one of the
+        processes in the pool.
+
+        If the process crashes during the batch, it gets restarted and the
+        batch is tried once more.
+        """
+        process = self.processes.get()
+        try:
+            try:
+                return process.add_metadata(batch)
+            except Exception:
+                return process.add_metadata(batch)
+        finally:
+            self.processes.put(process)
+
+
+    def add_metadata(self, paths, max_batch=1000):
+        """
+        Adds the metadata to every file in `paths`, in batches of up to
+        `max_batch` files spread over the processes in the pool.
+
+        Returns a dict of path: error message for every file that couldn't
+        be changed. (Raises an exception if exiftool itself keeps failing.)
+        """
+        paths = list(paths)
+        if not paths:
+            return {}
+
+        # (small enough batches that every process gets some work.)
+        batch_size = min(max_batch, math.ceil(len(paths) / self.size))
+        batches = [paths[i:i + batch_size]
+                   for i in range(0, len(paths), batch_size)]
+
+        failed = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.size) as pool:
+            for batch_failed in pool.map(self.add_metadata_batch, batches):
+                failed.update(batch_failed)
+        return failed
+
+
+    def close(self):
+        """
+        Stops all of the exiftool processes in the pool.
+        """
+        for process in self.all_processes:
+            process.stop()
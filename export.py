@@ -1,15 +1,24 @@
+import collections
+import concurrent.futures
 import itertools
 import os
 import queue
-import time
+import shutil
 import sys
+import time
 
 import check
+import files
 from exception import FilterException
-from export_thread import ExportThread
+from exiftool_pool import ExifToolPool
+from export_executor import ExportExecutor, raster_size
+from inkscape_shell import InkscapeShellPool
+from source_store import SourceStore
 from dest_paths import format_path, make_dir_structure_for_file
 import image_proc
 import log
+import png_metadata
+from timings import format_duration
 from util import get_formats_for_license_type
 
 
@@ -17,8 +26,18 @@ from util import get_formats_for_license_type
 
 
 
+"""
+How many pngc exports are collected before they're crushed (at most -b).
+This is smaller than -b usually is, so crushing happens alongside the rest
+of the export instead of all at the end.
+"""
+CRUSH_BATCH_SIZE = 32
+
+
+
 def export(m, filtered_emoji, input_path, formats, path, src_size,
-           num_threads, renderer, max_batch, verbose, license_enabled, cache):
+           limits, renderer, max_batch, verbose, license_enabled, cache,
+           pipe=False, journal=None, timings=None, shard=None):
     """
     Runs the entire orxporter process, includes preliminary checking and
     validation of emoji metadata and running the tasks associated with exporting.
@@ -26,14 +45,19 @@ def export(m, filtered_emoji, input_path, formats, path, src_size,
 
     # verify emoji (in a very basic way)
     # --------------------------------------------------------------------------
+    # (the source SVGs read while checking are kept around for the export.)
+    sources = SourceStore()
+
     log.out('Checking emoji...', 36)
     check_result = check.emoji(m, filtered_emoji, input_path, formats, path, src_size,
-               num_threads, renderer, max_batch, cache, license_enabled, verbose)
+               limits['io'], renderer, max_batch, cache, license_enabled, verbose,
+               shard, sources)
 
     exporting_emoji = check_result["exporting_emoji"]
     cached_emoji = check_result["cached_emoji"]
     cached_emoji_count = check_result["cached_emoji_count"]
     skipped_emoji_count = check_result["skipped_emoji_count"]
+    other_shard_emoji_count = check_result["other_shard_emoji_count"]
 
 
     # report back how the export is going to go
@@ -48,6 +72,10 @@ def export(m, filtered_emoji, input_path, formats, path, src_size,
         if not verbose:
             log.out(f"            (use the --verbose flag to see what those emoji are and why they are being skipped.)", 34)
 
+    if shard:
+        log.out(f"->[shard]   {other_shard_emoji_count} emoji are in other "
+                f"shards (this is shard {shard[0]} of {shard[1]}).", 34)
+
     if cached_emoji_count:
         log.out(f"->[cache]   {cached_emoji_count} emoji will be reused from cache.", 34)
         if verbose:
@@ -56,10 +84,30 @@ def export(m, filtered_emoji, input_path, formats, path, src_size,
 
     log.out(f"->[export]  {len(exporting_emoji)} emoji will be exported.", 34)
 
+    tasks, done_task_count = plan_tasks(exporting_emoji, path, renderer,
+                                        timings, journal)
+    if done_task_count:
+        log.out(f"->[resume]  {done_task_count} export tasks were already done "
+                "and will be skipped.", 34)
+
+    # (only estimate how long it'll take if every format has been timed before.)
+    if tasks and timings and all(timings.known(f, renderer) for _, f in tasks):
+        eta = timings.makespan(tasks, renderer, limits['tasks'])
+        log.out(f"->[export]  this should take about {format_duration(eta)}.", 34)
+
 
     # If there's no emoji to export or copy from cache, tell the program to quit.
     # --------------------------------------------------------------------------
     if len(exporting_emoji) == 0 and cached_emoji_count == 0:
+        # (there's nothing to resume either, so the journal isn't left
+        # behind in the output.)
+        if journal:
+            journal.close(finished=True)
+
+        # (a shard can be left with nothing if there are more shards than emoji.)
+        if shard and other_shard_emoji_count:
+            log.out(f"Nothing to do in this shard.", 34)
+            return
         raise SystemExit('>∆∆< It looks like you have no emoji to export!')
 
 
@@ -69,55 +117,65 @@ def export(m, filtered_emoji, input_path, formats, path, src_size,
     # --------------------------------------------------------------------------
     # declare some specs of this export.
 
-    if exporting_emoji:
-        export_step(exporting_emoji, num_threads, m, input_path, path,
-                    renderer, license_enabled, cache)
-
-
+    # (PNGs get their EXIF license metadata written into them as they're
+    # exported, unless it has tags that only exiftool knows about. Then the
+    # exif pass changes these formats after they're exported or copied from
+    # cache, so they have to be kept apart from the files in the cache.)
+    exif_formats = ()
+    png_license = None
+    if ('exif' in m.license) and license_enabled:
+        try:
+            png_license = png_metadata.license_chunks(m.license['exif'])
+        except ValueError as e:
+            log.out(f"Using exiftool for the EXIF metadata. ({e})", 34)
+            exif_formats = get_formats_for_license_type('exif')
 
-    # Copy files from cache
-    # --------------------------------------------------------------------------
+    # start copying files from the cache in the background
+    restore = None
     if cached_emoji_count > 0:
-        log.out(f"Copying {cached_emoji_count} emoji from cache...", 36)
-
-        bar = log.get_progress_bar(max=cached_emoji_count)
+        restore = start_restore(cached_emoji, path, cache, exif_formats,
+                                limits['io'])
 
+    if tasks:
         try:
-            # Copy the exports (without license)
-            for e, fs in cached_emoji['exports']:
-                bar.next()
-                for f in fs:
-                    final_path = format_path(path, e, f)
-                    make_dir_structure_for_file(final_path)
-                    cache.load_from_cache(e, f, final_path, False)
-
-            # Copy the licensed exports (populated if license_enabled is True)
-            for e, fs in cached_emoji['licensed_exports']:
-                bar.next()
-                for f in fs:
-                    final_path = format_path(path, e, f)
-                    make_dir_structure_for_file(final_path)
-                    cache.load_from_cache(e, f, final_path, True)
-        except (KeyboardInterrupt, SystemExit):
-            # Make sure the bar is properly set if oxporter is told to exit
-            bar.finish()
+            results = export_step(tasks, limits, m, input_path, path, renderer,
+                                  max_batch, license_enabled, cache, pipe,
+                                  journal, sources, exif_formats, png_license)
+        except BaseException:
+            if restore:
+                cancel_restore(*restore)
             raise
 
+        # remember how long everything took for next time.
+        if timings:
+            timings.record(results, renderer)
+            timings.save()
 
-        bar.finish()
-        log.out(f"- done!", 32)
+
+
+    # Copy files from cache
+    # --------------------------------------------------------------------------
+    # (this was started before the export, and runs alongside it.)
+    if restore:
+        finish_restore(*restore)
 
 
     # exif license pass
-    # (currently only just applies to PNGs)
+    # (currently only just applies to PNGs; if the metadata is written
+    # natively, it's only needed for the files copied from cache without it.)
     # --------------------------------------------------------------------------
-    if ('exif' in m.license) and license_enabled:
+    if exif_formats or png_license:
         exif_compatible_images = []
-        exif_supported_formats = get_formats_for_license_type('exif')
+        license_formats = get_formats_for_license_type('exif')
+
+        # (exported PNGs already have the metadata written natively.)
+        exif_emoji = cached_emoji['exports']
+        if exif_formats:
+            exif_emoji = itertools.chain(exporting_emoji, exif_emoji)
 
-        for e, fs in itertools.chain(exporting_emoji, cached_emoji['exports']):
+        for e, fs in exif_emoji:
             for f in fs:
-                if f.split("-")[0] in exif_supported_formats:
+                if f.split("-")[0] in license_formats:
 
                     try:
                         final_path = format_path(path, e, f)
@@ -129,115 +187,425 @@ def export(m, filtered_emoji, input_path, formats, path, src_size,
 
         if exif_compatible_images:
             log.out(f'Adding EXIF metadata to {len(exif_compatible_images)} compatible raster files...', 36)
-            images_list = (i for i, _, _ in exif_compatible_images)
-            image_proc.batch_add_exif_metadata(images_list, m.license.get('exif'), max_batch)
+            if png_license:
+                failed = add_png_license((i for i, _, _ in exif_compatible_images),
+                                         png_license, limits['io'])
+            else:
+                exiftools = ExifToolPool(limits['exiftool'], m.license.get('exif'))
+                try:
+                    failed = exiftools.add_metadata((i for i, _, _ in exif_compatible_images),
+                                                    max_batch)
+                finally:
+                    exiftools.close()
+
+            for final_path, e, f in exif_compatible_images:
+                if final_path in failed:
+                    log.out(f"- Couldn't add EXIF metadata to '{e['short']}' "
+                            f"as {f}: {failed[final_path]}", 31)
 
             # Copy exported emoji to cache
+            # (but not the ones that are missing their metadata.)
             if cache:
-                log.out(f"Copying {len(exif_compatible_images)} licensed "
-                        "raster files to cache...", 36)
+                log.out(f"Copying {len(exif_compatible_images) - len(failed)} "
+                        "licensed raster files to cache...", 36)
                 for final_path, e, f in exif_compatible_images:
+                    if final_path in failed:
+                        continue
                     if not cache.save_to_cache(e, f, final_path, license_enabled=True):
                         raise RuntimeError(f"Unable to save '{e['short']}' in "
                                            f"{f} with license to cache.")
 
+            if failed:
+                raise RuntimeError(f"Couldn't add EXIF metadata to "
+                                   f"{len(failed)} files.")
 
+    # write out when the cache files were used (for eviction)
+    if cache:
+        cache.flush()
+
+    # keep the cache within its maximum size
+    if cache and cache.max_size:
+        log.out(f"Evicting the least recently used files from the cache...", 36)
+        evicted_count, freed = cache.evict()
+        log.out(f"-> {evicted_count} files ({freed / 1024 ** 2:.1f} MiB)")
+
+    if cache:
+        log_cache_stats(cache)
+        cache.save_stats()
 
-def export_step(exporting_emoji, num_threads, m, input_path, path, renderer, license_enabled, cache):
-    log.out(f"Exporting {len(exporting_emoji)} emoji...", 36)
+    # everything has been exported, so there's nothing left to resume.
+    if journal:
+        journal.close(finished=True)
 
-    if num_threads > 1:
-        log.out(f"-> {num_threads} threads")
-    else:
-        log.out(f"-> {num_threads} thread")
 
+
+def add_png_license(paths, png_license, num_threads):
+    """
+    Writes license metadata chunks (from png_metadata.license_chunks())
+    into the PNG files at `paths`, on `num_threads` threads.
+
+    Returns a dict of path: error message for every file that couldn't
+    be changed (like ExifToolPool.add_metadata()).
+    """
+    def add(path):
+        try:
+            png_metadata.add_chunks_to_file(path, png_license)
+        except (OSError, ValueError) as e:
+            return path, str(e)
+        return path, None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as pool:
+        return {path: err for path, err in pool.map(add, paths) if err}
+
+
+
+def crush_pngs(paths, max_batch, threads):
+    """
+    Crushes a batch of pngc exports (see image_proc.batch_crush_png()),
+    returning how long it took.
+    """
+    start = time.perf_counter()
+    image_proc.batch_crush_png(paths, max_batch, threads)
+    return time.perf_counter() - start
+
+
+
+def start_restore(cached_emoji, path, cache, exif_formats, num_threads):
+    """
+    Starts copying the exports that are in the cache to their final paths,
+    on `num_threads` threads, so it can happen while other emoji are being
+    exported. Each output directory is only made once.
+
+    Returns the thread pool and the futures of the copies (see
+    finish_restore()).
+    """
+    jobs = []
+    made_dirs = set()
+
+    # (exports without license, then the licensed exports, which are
+    # populated if license_enabled is True.)
+    for licensed, group in ((False, cached_emoji['exports']),
+                            (True, cached_emoji['licensed_exports'])):
+        for e, fs in group:
+            for f in fs:
+                final_path = format_path(path, e, f)
+
+                dirname = os.path.dirname(final_path)
+                if dirname not in made_dirs:
+                    make_dir_structure_for_file(final_path)
+                    made_dirs.add(dirname)
+
+                # (exports without license get EXIF metadata added later.)
+                editable = not licensed and f.split("-")[0] in exif_formats
+                jobs.append((e, f, final_path, licensed, editable))
+
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=num_threads)
+    futures = [pool.submit(cache.load_from_cache, *job) for job in jobs]
+    return pool, futures
+
+
+
+def finish_restore(pool, futures):
+    """
+    Waits for the copies started by start_restore() to finish, showing
+    their progress.
+    """
+    log.out(f"Copying {len(futures)} files from cache...", 36)
+
+    bar = log.get_progress_bar(max=len(futures))
     try:
-        # start a Queue object for emoji export
-        emoji_queue = queue.Queue()
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+            bar.next()
+    except BaseException:
+        # Make sure the bar is properly set if oxporter is told to exit
+        # (or a copy failed), and stop the copies that haven't started.
+        bar.finish()
+        cancel_restore(pool, futures)
+        raise
 
-        # put the [filtered] emoji+formats (plus the index, cuz enumerate()) into the queue.
-        for entry in enumerate(exporting_emoji):
-            emoji_queue.put(entry)
+    pool.shutdown()
+    bar.finish()
+    log.out(f"- done!", 32)
 
-        # initialise the amount of requested threads
-        threads = []
-        for i in range(num_threads):
-            threads.append(ExportThread(emoji_queue, str(i), len(exporting_emoji),
-                                        m, input_path, path, renderer,
-                                        license_enabled))
 
 
-        # keeps checking if the export queue is done.
-        bar = log.get_progress_bar(max=len(exporting_emoji))
-        while True:
-            done = emoji_queue.empty()
+def cancel_restore(pool, futures):
+    """
+    Stops the copies started by start_restore() that haven't started yet,
+    and waits for the rest to finish.
+    """
+    for future in futures:
+        future.cancel()
+    pool.shutdown(wait=True)
 
-            bar.goto(log.export_task_count)
 
-            # if the thread has an error, properly terminate it
-            # and then raise an error.
-            for t in threads:
-                if t.err is not None:
-                    for u in threads:
-                        u.kill()
-                        u.join()
 
-                    raise ValueError(f'Thread {t.name} failed: {t.err}') from t.err
+def log_cache_stats(cache):
+    """
+    Prints how the cache was used in this export, for each format.
+    """
+    stats = cache.get_stats()
+    mib = lambda n: f"{n / 1024 ** 2:.1f} MiB"
+
+    def log_counts(f, counts):
+        log.out(f"-> {f}: {counts.get('hits', 0)} hits, "
+                f"{counts.get('misses', 0)} misses, "
+                f"{mib(counts.get('restored_bytes', 0))} restored in "
+                f"{counts.get('restore_time', 0):.2f}s, "
+                f"{mib(counts.get('stored_bytes', 0))} stored in "
+                f"{counts.get('store_time', 0):.2f}s", 34)
+
+    log.out(f"Cache statistics:", 34)
+    for f, counts in itertools.chain(stats['formats'].items(),
+                                     [('total', stats['total'])]):
+        log_counts(f, counts)
+    log.out(f"-> working out cache keys took {stats['key_time']:.2f}s", 34)
+
+    # (raw renders are only looked up for exports that weren't in the
+    # cache, so they're kept out of the totals above.)
+    if stats['renders']:
+        log.out(f"Raw render cache statistics:", 34)
+        for f, counts in itertools.chain(stats['renders'].items(),
+                                         [('total', stats['renders_total'])]):
+            log_counts(f, counts)
+
+
+
+def finish_task(emoji, f, path, license_enabled, cache, journal,
+                exif_formats=(), png_license=None):
+    """
+    Saves a finished export task to the cache and records it in the
+    journal (if they're enabled).
+    """
+    final_path = format_path(path, emoji, f)
+
+    if cache and f in cache.filter_cacheable_formats((f,), license_enabled):
+        # SVG (and PNG, if `png_license` is given) has a license added
+        # during export, so this flag passed to save_to_cache needs to be
+        # adjusted
+        has_license = license_enabled and (
+            f == 'svg' or (png_license is not None
+                           and f.split("-")[0] in ('png', 'pngc')))
+        cache.save_to_cache(emoji, f, final_path, has_license,
+                            f.split("-")[0] in exif_formats)
+
+    if journal:
+        journal.record(emoji, f, final_path)
+
+
+
+def plan_tasks(exporting_emoji, path, renderer, timings=None, journal=None):
+    """
+    Splits the work up into a task for every format of every emoji, so
+    that emoji with many formats don't hold up a single worker, and puts
+    them in the order they should be started in.
 
-            if done:
-                break
+    Tasks that share a render (the same emoji at the same size) are kept
+    together, so renders are only kept around while they're being used.
+    Those groups are ordered longest first, going by the `timings` of
+    earlier exports, so the biggest tasks don't end up running on their own
+    at the end of the export.
 
-            time.sleep(0.01) # wait a little before seeing if stuff is done again.
+    Tasks that the journal says were already finished are left out.
+
+    Returns the tasks (as (emoji, format) pairs) and how many were left out.
+    """
+    groups = collections.OrderedDict()
+    done_task_count = 0
+
+    for emoji, fs in exporting_emoji:
+        for f in fs:
+            if journal and journal.is_done(emoji, f, format_path(path, emoji, f)):
+                done_task_count += 1
+                continue
+            groups.setdefault((id(emoji), raster_size(f)), []).append((emoji, f))
+
+    groups = list(groups.values())
+    if timings:
+        cost = lambda task: timings.estimate(task[1], renderer)
+        for group in groups:
+            group.sort(key=cost, reverse=True)
+        groups.sort(key=lambda group: sum(map(cost, group)), reverse=True)
+
+    return [task for group in groups for task in group], done_task_count
+
+
+
+def export_step(tasks, limits, m, input_path, path, renderer,
+                max_batch, license_enabled, cache, pipe=False, journal=None,
+                sources=None, exif_formats=(), png_license=None):
+    """
+    Exports every (emoji, format) task in `tasks` with an ExportExecutor,
+    within the given concurrency `limits`.
+
+    Each task is saved to the cache and recorded in the journal as soon as
+    it's finished, so an interrupted export loses as little as possible.
+
+    Returns the TaskResult of every task (in the order they finished).
+    """
+    log.out(f"Exporting {len(set(id(emoji) for emoji, _ in tasks))} emoji...", 36)
+
+    log.out("-> " + ", ".join(f"{name} {limits[name]}" for name in limits))
+
+    log.out(f"-> {len(tasks)} export tasks")
+
+    # (the inkscape-shell renderer keeps an Inkscape running for each render
+    # that can happen at once.)
+    shells = None
+    if renderer == 'inkscape-shell':
+        shells = InkscapeShellPool(limits['render'])
+
+    # (pipe mode keeps temporary files out of the current directory.)
+    scratch_dir = ''
+    if pipe:
+        scratch_dir = files.make_scratch_dir()
+
+    executor = None
+    results = []
+    bar = None
+
+    # (pngc exports are written out uncrushed by the executor, then crushed
+    # in batches so oxipng isn't started for every file. Batches are
+    # crushed one at a time, since oxipng spreads each batch over its own
+    # threads, while the export carries on.)
+    crush_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    # (batches are lists of indices into `results`.)
+    crush_batch = []
+    crushing = []
+    crush_batch_size = min(max_batch, CRUSH_BATCH_SIZE)
+
+    def finish_crushes(wait=False):
+        """
+        Finishes the crush batches that are done (or all of them, if
+        `wait`), saving them to the cache and the journal.
+        """
+        while crushing and (wait or crushing[0][0].done()):
+            future, batch = crushing.pop(0)
+            try:
+                seconds = future.result()
+            except Exception as e:
+                raise ValueError(f"Crushing PNG files failed: {e}") from e
+
+            # (the crush is part of the work of each pngc task.)
+            for result_index in batch:
+                result = results[result_index]
+                results[result_index] = result._replace(
+                    work=result.work + seconds / len(batch))
+                finish_task(result.emoji, result.format, path,
+                            license_enabled, cache, journal, exif_formats,
+                            png_license)
+
+    def start_crush():
+        """
+        Starts crushing the pngc exports that have been collected so far.
+        """
+        batch = list(crush_batch)
+        crush_batch.clear()
+        future = crush_pool.submit(crush_pngs,
+                                   [format_path(path, results[i].emoji,
+                                                results[i].format)
+                                    for i in batch],
+                                   max_batch, limits.get('oxipng'))
+        crushing.append((future, batch))
+
+    try:
+        # the executor reports every finished task (or error) to this queue.
+        result_queue = queue.Queue()
+
+        executor = ExportExecutor(tasks, result_queue, m, input_path, path,
+                                  renderer, limits, license_enabled, shells,
+                                  pipe, scratch_dir, sources, cache,
+                                  png_license)
+
+
+        # wait for every task to report back, moving the progress bar
+        # as they come in.
+        bar = log.get_progress_bar(max=len(tasks))
+        while len(results) < len(tasks):
+            result = result_queue.get()
+            results.append(result)
+            bar.next()
+
+            # pngc exports aren't finished until they've been crushed.
+            if result.err is None and result.format.split("-")[0] == "pngc":
+                crush_batch.append(len(results) - 1)
+                if len(crush_batch) >= crush_batch_size:
+                    start_crush()
+            elif result.err is None:
+                finish_task(result.emoji, result.format, path,
+                            license_enabled, cache, journal, exif_formats,
+                            png_license)
+
+            # if a task failed, properly terminate the executor
+            # and then raise an error.
+            if result.err is not None:
+                executor.kill()
+                executor.join()
+
+                raise ValueError(f"Worker {result.thread} failed to export "
+                                 f"'{result.emoji.get('short', '<UNNAMED>')}' "
+                                 f"as {result.format}: {result.err}") from result.err
+
+            try:
+                finish_crushes()
+            except ValueError:
+                executor.kill()
+                executor.join()
+                raise
 
         # finish the stuff
-        # - join the threads
+        # - join the executor
         # - then finish the terminal stuff
-        for t in threads:
-            t.join()
-
+        executor.join()
 
-        bar.goto(log.export_task_count)
         bar.finish()
 
+        # Crush the rest of the pngc exports
+        crush_count = len(crush_batch) + sum(len(batch) for _, batch in crushing)
+        if crush_count:
+            log.out(f'Crushing {crush_count} PNG files...', 36)
+            if crush_batch:
+                start_crush()
+            finish_crushes(wait=True)
+
 
     except (KeyboardInterrupt, SystemExit):
         # make sure all those threads are tidied before exiting the program.
         # also make sure the bar is finished so it doesnt eat the cursor.
-        bar.finish()
+        if bar:
+            bar.finish()
         log.out(f'Stopping threads and tidying up...', 93)
-        if threads:
-            for t in threads:
-                t.kill()
-                t.join()
+        if executor:
+            executor.kill()
+            executor.join()
 
         raise
 
-    # Copy exported emoji to cache
-    if cache:
-        # Calculate the real set of exported emoji to cache
-        exports_to_cache = []
-        for emoji, fs in exporting_emoji:
-            cacheable_fs = cache.filter_cacheable_formats(fs, license_enabled)
-            if cacheable_fs:
-                exports_to_cache.append((emoji, cacheable_fs))
-
-        # Save cacheable exports in cache
-        if exports_to_cache:
-            log.out(f'Copying {len(exports_to_cache)} exported emoji to '
-                    'cache...', 36)
-            for emoji, fs in exports_to_cache:
-                for f in fs:
-                    # SVG has a license added during export, so this
-                    # flag passed to save_to_cache needs to be adjusted
-                    has_license = f in ('svg') and license_enabled
-
-                    export_path = format_path(path, emoji, f)
-                    cache.save_to_cache(emoji, f, export_path, has_license)
-
+    finally:
+        # (a batch that's being crushed is left to finish, so it isn't
+        # left half-written.)
+        for future, _ in crushing:
+            future.cancel()
+        crush_pool.shutdown(wait=True)
+
+        # pngc exports that weren't crushed and recorded (because the export
+        # stopped) are removed, so they aren't mistaken for finished ones and
+        # --resume exports them again.
+        for i in crush_batch + [i for _, batch in crushing for i in batch]:
+            final_path = format_path(path, results[i].emoji, results[i].format)
+            if os.path.exists(final_path):
+                os.remove(final_path)
+
+        if shells:
+            shells.close()
+        if scratch_dir:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
 
     log.out('done!', 32)
     if log.filtered_export_task_count > 0:
         log.out(f"-> {log.filtered_export_task_count} emoji have been implicitly or explicitly filtered out of this export task.", 34)
 
-    log.export_task_count = 0
     log.filtered_export_task_count = 0
+
+    return results
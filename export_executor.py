@@ -0,0 +1,490 @@
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import os
+import threading
+import time
+
+import dest_paths
+import export_task
+import files
+import util
+
+
+
+"""
+The concurrency limits the executor understands:
+- tasks: how many export tasks are worked on at once
+- render: how many SVGs are being rendered at once
+- cwebp, cjxl: how many of each encoder are running at once
+- oxipng: how many threads each oxipng batch uses
+- io: how many file reads/writes are happening at once
+- exiftool: how many exiftool processes add EXIF metadata at once
+"""
+LIMIT_NAMES = ('tasks', 'render', 'cwebp', 'cjxl', 'oxipng', 'io', 'exiftool')
+
+"""Which limit the final step of each format is counted against."""
+_format_limit_map = {
+    'svg': 'io',
+    'png': 'io',
+    'pngc': 'io',
+    'webp': 'cwebp',
+    'jxl': 'cjxl',
+}
+
+"""
+The result of a single export task, as sent by the ExportExecutor to the
+main thread when the task is finished.
+
+`err` is the exception the task raised (or None if it went fine),
+`duration` is how long the task took, in seconds, and `work` is how much of
+that was spent actually working on it (not waiting for a concurrency limit),
+with the time of a shared render split between the tasks that share it.
+`cached` is True if the task's render came from the cache (so `work`
+doesn't say how long it really takes).
+"""
+TaskResult = collections.namedtuple('TaskResult',
+                                    ['index', 'emoji', 'format', 'err',
+                                     'duration', 'work', 'thread', 'cached'])
+
+
+
+def get_limits(num_threads, given):
+    """
+    Makes the full set of concurrency limits, from the number of threads
+    (which is the default for every limit except oxipng) and the limits
+    the user has given (as a dict of name: number, either as ints or as
+    strings).
+    """
+    limits = {name: num_threads for name in LIMIT_NAMES if name != 'oxipng'}
+
+    for name, value in given.items():
+        if name not in LIMIT_NAMES:
+            raise ValueError(f"'{name}' is not a concurrency limit orxporter "
+                             f"knows about. (It knows {', '.join(LIMIT_NAMES)})")
+        try:
+            value = int(value)
+        except ValueError:
+            value = 0
+        if value <= 0:
+            raise ValueError(f"The '{name}' concurrency limit has to be a "
+                             "number above 0.")
+        limits[name] = value
+
+    return limits
+
+
+
+def raster_size(f):
+    """
+    Gets the size of a raster format (ie. 64 for 'png-64'), or None if
+    the format isn't a raster format with a valid size.
+    """
+    raster_format = f.split("-")
+    if len(raster_format) != 2:
+        return None
+    try:
+        return int(raster_format[1])
+    except ValueError:
+        return None
+
+
+
+class ExportExecutor:
+    """
+    Runs export tasks (a single emoji in a single format each) on an asyncio
+    event loop in its own thread.
+
+    Every step of a task is counted against a separate concurrency limit
+    (rendering, each encoder, file I/O), so that slow encoders like cjxl
+    can be kept from taking over the machine while quick I/O carries on.
+    The blocking work of each step is done on a thread pool.
+
+    A task holds one of the `tasks` worker slots until it has to wait for
+    an encoder, when it gives the slot to the next task so that loads and
+    renders carry on while the encoders are busy. (Up to `tasks` tasks can
+    be left waiting for an encoder like this, so their renders don't pile up.)
+
+    The loaded source SVG of an emoji is shared by all of its tasks (and is
+    read from the `source_store` filled in by the check, if there is one), and a
+    render of an emoji at a given size is shared by all of the raster tasks
+    of that size. Both are dropped once the last task needing them is done.
+    Renders are taken from the `cache` when it has them, and saved to it
+    when it doesn't (unless they're exported as png, which is cached as the
+    same file).
+
+    Each finished task is reported as a TaskResult in the `results` queue.
+    """
+
+    def __init__(self, tasks, results, m, input_path, path, renderer,
+                 limits, license_enabled, shells=None, pipe=False,
+                 scratch_dir='', source_store=None, cache=None,
+                 png_license=None):
+        self.tasks = tasks
+        self.results = results
+        self.m = m
+        self.input_path = input_path
+        self.path = path
+        self.renderer = renderer
+        self.limits = limits
+        self.license_enabled = license_enabled
+        self.shells = shells
+        self.pipe = pipe
+        self.scratch_dir = scratch_dir
+        self.source_store = source_store
+        self.cache = cache
+        self.png_license = png_license
+
+        # how many tasks still need each emoji's source and render
+        # (keyed by the id of the emoji, and the id of the emoji and size)
+        self.pending_sources = collections.Counter(id(emoji) for emoji, _ in tasks)
+        self.pending_renders = collections.Counter(
+            (id(emoji), size) for emoji, f in tasks
+            for size in [raster_size(f)] if size is not None)
+        self.render_shares = dict(self.pending_renders)
+        # the emoji and sizes that are exported as png without a license
+        # written in by the executor, whose cache entry is the render itself
+        # (so the render doesn't need its own).
+        self.png_exports = set()
+        if png_license is None:
+            self.png_exports = set((id(emoji), raster_size(f)) for emoji, f in tasks
+                                   if f.split("-")[0] == 'png')
+        self.sources = {}
+        self.renders = {}
+        self.render_paths = {}
+        self.render_counter = itertools.count()
+
+        self.loop = None
+        self.main_task = None
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+
+    def kill(self):
+        """
+        Requests the executor to stop working on tasks.
+        """
+        self.started.wait()
+        try:
+            if self.main_task:
+                self.loop.call_soon_threadsafe(self.main_task.cancel)
+        except RuntimeError:
+            # the loop has already finished.
+            pass
+
+
+    def join(self):
+        """
+        Wait for the executor's thread to finish.
+        """
+        self.thread.join()
+
+
+    def run(self):
+        """
+        Runs the event loop until every task is done (or the executor is
+        killed). This is what the executor's thread works on.
+        """
+        self.loop = asyncio.new_event_loop()
+        # (enough threads for every worker, and for every encoder that's
+        # running for a task that gave its worker slot away.)
+        pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=sum(self.limits[name] for name in ('tasks', 'cwebp', 'cjxl')))
+        self.loop.set_default_executor(pool)
+
+        try:
+            self.loop.run_until_complete(self.run_all())
+        except asyncio.CancelledError:
+            # let any loads and renders that were left behind finish
+            # being cancelled before the loop closes.
+            leftovers = list(self.sources.values()) + list(self.renders.values())
+            for future in leftovers:
+                future.cancel()
+            self.loop.run_until_complete(asyncio.gather(*leftovers,
+                                                        return_exceptions=True))
+        finally:
+            self.started.set()
+            self.loop.close()
+            # (wait for renders that were still running before tidying up.)
+            pool.shutdown()
+            self.clear()
+
+
+    async def run_all(self):
+        """
+        Works through every task with `tasks` workers.
+        """
+        # (semaphores and queues have to be made inside the loop they're
+        # used in.)
+        self.semaphores = {name: asyncio.Semaphore(self.limits[name])
+                           for name in ('render', 'cwebp', 'cjxl', 'io')}
+
+        # the worker slots, by name, and how many tasks can be going at
+        # once (including those that have given their slot away).
+        self.workers = asyncio.Queue()
+        for i in range(self.limits['tasks']):
+            self.workers.put_nowait(str(i))
+        self.in_flight = asyncio.Semaphore(self.limits['tasks'] * 2)
+
+        self.main_task = asyncio.ensure_future(self.dispatch())
+        self.started.set()
+        await self.main_task
+
+
+    async def dispatch(self):
+        """
+        Starts every task (in order) as soon as there's a worker slot for
+        it, until there are none left or one of them fails.
+        """
+        running = set()
+        self.failed = False
+
+        try:
+            for i, (emoji, f) in enumerate(self.tasks):
+                await self.in_flight.acquire()
+                name = await self.workers.get()
+                if self.failed:
+                    break
+
+                task = asyncio.ensure_future(self.work(i, emoji, f, name))
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+            if running:
+                await asyncio.gather(*running)
+        finally:
+            # (if the export was stopped, the tasks that are still going
+            # are stopped too.)
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+
+    async def work(self, i, emoji, f, name):
+        """
+        Works on a single task in the worker slot `name`, and gives the
+        slot back once the task is done (if it hasn't already been).
+        """
+        holding = True
+
+        def release_slot():
+            nonlocal holding
+            if holding:
+                holding = False
+                self.workers.put_nowait(name)
+
+        start = time.perf_counter()
+        work = 0.0
+        cached = False
+        err = None
+        try:
+            work, cached = await self.export_emoji(emoji, f, release_slot)
+        except asyncio.CancelledError:
+            # (before Python 3.8, this is an Exception too; a stopped task
+            # isn't a failed one.)
+            raise
+        except Exception as e:
+            err = e
+            self.failed = True
+        finally:
+            release_slot()
+            self.in_flight.release()
+
+        # tell the main thread that this task has been completed
+        # (or that it failed, in which case no more tasks are started).
+        self.results.put(TaskResult(i, emoji, f, err,
+                                    time.perf_counter() - start, work,
+                                    name, cached))
+
+
+    async def call(self, limit, fn, *args, release_slot=None):
+        """
+        Calls a blocking function on the thread pool, once there's room
+        for it under the given concurrency limit. If there isn't room yet,
+        `release_slot` (if given) is called first, so the task's worker
+        slot isn't kept while waiting.
+
+        Returns what the function returned, and how long it took to run.
+        """
+        semaphore = self.semaphores[limit]
+        if release_slot and semaphore.locked():
+            release_slot()
+
+        async with semaphore:
+            start = time.perf_counter()
+            res = await self.loop.run_in_executor(None, fn, *args)
+            return res, time.perf_counter() - start
+
+
+    async def get_source(self, emoji):
+        """
+        Gets the SVG of an emoji, loading it if no other task has yet.
+        """
+        key = id(emoji)
+        if key not in self.sources:
+            self.sources[key] = asyncio.ensure_future(
+                self.call('io', export_task.load_svg, self.m,
+                          self.input_path, emoji, self.source_store))
+        emoji_svg, _ = await self.sources[key]
+        return emoji_svg
+
+
+    def release_source(self, emoji):
+        """
+        Tells the executor that a task is done with an emoji's SVG.
+        """
+        key = id(emoji)
+        self.pending_sources[key] -= 1
+        if self.pending_sources[key] <= 0:
+            self.sources.pop(key, None)
+
+
+    async def get_render(self, emoji, emoji_svg, size):
+        """
+        Gets the render (a RenderedPng) of an emoji at a size, rendering
+        it if no other task has yet.
+
+        Also returns this task's share of the time the render took, and
+        whether the render came from the cache.
+        """
+        key = (id(emoji), size)
+        if key not in self.renders:
+            # (the pid keeps renders apart from those of other orxporters,
+            # ie. other shards, running in the same directory.)
+            png_path = os.path.join(self.scratch_dir,
+                                    f'.tmpr{os.getpid()}-{next(self.render_counter)}.png')
+            self.render_paths[key] = png_path
+            self.renders[key] = asyncio.ensure_future(
+                self.make_render(emoji, emoji_svg, size, png_path))
+        render, seconds, cached = await self.renders[key]
+        return render, seconds / self.render_shares[key], cached
+
+
+    async def make_render(self, emoji, emoji_svg, size, png_path):
+        """
+        Renders an emoji at a size to `png_path` (or loads the render from
+        the cache), returning the RenderedPng, how long it took and whether
+        it came from the cache.
+        """
+        if self.cache:
+            found, seconds = await self.call('io', self.cache.load_render, emoji,
+                                             size, self.renderer, png_path)
+            if found:
+                return export_task.RenderedPng(png_path), seconds, True
+
+        render, seconds = await self.call('render', export_task.render,
+                                          emoji_svg, png_path, self.renderer,
+                                          size, self.shells, self.pipe)
+
+        if self.cache and (id(emoji), size) not in self.png_exports:
+            await self.call('io', self.cache.save_render, emoji, size,
+                            self.renderer, None if render.data is not None
+                            else render.path, render.data)
+        return render, seconds, False
+
+
+    def release_render(self, emoji, size):
+        """
+        Tells the executor that a task is done with a render, deleting it
+        if no other task needs it.
+        """
+        key = (id(emoji), size)
+        self.pending_renders[key] -= 1
+        if self.pending_renders[key] <= 0:
+            future = self.renders.pop(key, None)
+            # (a render that's still going, because its task was stopped, is
+            # left for clear() to delete once its thread is done with it.)
+            if future is not None and not future.done():
+                return
+            self.remove_render(self.render_paths.pop(key, None))
+
+
+    @staticmethod
+    def remove_render(png_path):
+        """
+        Deletes a render's temporary files (if it has any).
+        """
+        if not png_path:
+            return
+
+        for path in (png_path, os.path.splitext(png_path)[0] + '.svg'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+    def clear(self):
+        """
+        Deletes any renders that are still around (ie. if the export was
+        stopped before every task finished).
+        """
+        for png_path in self.render_paths.values():
+            self.remove_render(png_path)
+        self.render_paths.clear()
+        self.renders.clear()
+        self.sources.clear()
+
+
+    async def export_emoji(self, emoji, f, release_slot=None):
+        """
+        Runs a single export task, returning how long it spent working
+        and whether its render came from the cache.
+
+        `release_slot` gives the task's worker slot to another task; it's
+        called if the task has to wait for an encoder.
+        """
+        final_path = dest_paths.format_path(self.path, emoji, f)
+
+        image_format = f.split("-")[0]
+        if image_format not in _format_limit_map:
+            raise ValueError(f"""A format you gave ('{f}') uses a file format
+                            ('{image_format}') that orxporter
+                            doesn't support.""")
+
+        # any format other than svg is a raster, therefore it needs
+        # to have a number separated by a dash.
+        size = None
+        if f != 'svg':
+            size = raster_size(f)
+            if size is None:
+                raise ValueError(f"""A format you gave ('{f}') isn't correct. All formats
+                                    that aren't svg must have a number separated by a dash.
+                                    (ie 'png-32', 'webp-128')""")
+
+        try:
+            # try to make the directory for this particular export, and make
+            # sure an earlier export linked from the cache isn't written over.
+            await self.call('io', dest_paths.make_dir_structure_for_file, final_path)
+            await self.call('io', files.unshare, final_path)
+
+            # get the SVG of the emoji (shared with the other
+            # tasks of this emoji) and export it as this format.
+            emoji_svg = await self.get_source(emoji)
+
+            # svg format doesn't involve a resolution so it can go straight to export.
+            if f == 'svg':
+                svg_license = self.m.license.get(util.get_license_type_for_format(f))
+                _, seconds = await self.call('io', export_task.to_svg, emoji_svg,
+                                             final_path, svg_license,
+                                             self.license_enabled)
+                return seconds, False
+
+            # get the render at this size (shared with the other formats of
+            # the same size) and convert it based on the format.
+            try:
+                render, render_seconds, cached = await self.get_render(emoji, emoji_svg, size)
+                encoder = _format_limit_map[image_format]
+                _, seconds = await self.call(encoder,
+                                             export_task.to_raster, render,
+                                             final_path, image_format, self.pipe,
+                                             self.png_license,
+                                             release_slot=release_slot
+                                             if encoder != 'io' else None)
+                return render_seconds + seconds, cached
+            finally:
+                self.release_render(emoji, size)
+
+        finally:
+            self.release_source(emoji)
@@ -1,13 +1,48 @@
 
 import os
 import pathlib
+import shutil
 import subprocess
+import threading
 
 import files
+import png_metadata
 import svg
 import image_proc
 
-def to_svg(emoji_svg, out_path, name, license=None, license_enabled=True, optimise=False):
+def load_svg(m, input_path, emoji, sources=None):
+    """
+    Loads the source SVG of an emoji (from a SourceStore if `sources` is
+    given) and converts its colormaps.
+    """
+    # check if the src attribute is in the emoji.
+    # if so, make a proper path out of it.
+    if 'src' not in emoji:
+        raise ValueError('Missing src attribute')
+
+    srcpath = os.path.join(m.homedir, input_path, emoji['src'])
+
+    # load the SVG source file
+    try:
+        if sources is not None:
+            emoji_svg = sources.read(srcpath)
+        else:
+            emoji_svg = open(srcpath, 'r').read()
+    except Exception:
+        raise ValueError('Could not load file: ' + srcpath)
+
+    # convert colormaps (if applicable)
+    # (this was most likely done already for the emoji's cache key; it's
+    # only needed once, since every format of the emoji shares the source.)
+    emoji_svg, _ = svg.translate_emoji_color(emoji, m, emoji_svg)
+    svg.forget_translated_color(emoji)
+
+    return emoji_svg
+
+
+
+
+def to_svg(emoji_svg, out_path, license=None, license_enabled=True, optimise=False):
     """
     SVG exporting function. Doesn't create temporary files.
     Will append license <metadata> if requested.
@@ -23,40 +58,108 @@ def to_svg(emoji_svg, out_path, name, license=None, license_enabled=True, optimi
 
 
 
-def to_raster(emoji_svg, out_path, renderer, format, size, name):
+class RenderedPng:
     """
-    Raster exporting function. Can export to any of orxporter's supported raster formats.
-    Creates and deletes temporary SVG files. Might also create and delete temporary PNG files depending on the format.
+    A rendered PNG of an emoji, that is either in a temporary file (`path`)
+    or in memory (`data`), depending on the renderer that made it.
+
+    If something needs the other form, it's made when it's first asked for.
+    """
+    def __init__(self, path, data=None):
+        self.path = path
+        self.data = data
+        self.lock = threading.Lock()
+        self.on_disk = data is None
+
+
+    def file(self):
+        """
+        Gets the path to the render, writing it out first if it's in memory.
+        """
+        with self.lock:
+            if not self.on_disk:
+                files.try_write(self.data, self.path, "temporary PNG")
+                self.on_disk = True
+        return self.path
+
+
+    def bytes(self):
+        """
+        Gets the PNG data of the render, reading it first if it's on disk.
+        """
+        with self.lock:
+            if self.data is None:
+                with open(self.path, 'rb') as f:
+                    self.data = f.read()
+        return self.data
+
+
+
+
+def render(emoji_svg, png_out, renderer, size, shells=None, pipe=False):
+    """
+    Renders an SVG (as a string), returning a RenderedPng.
+
+    The cairosvg renderer renders in memory. If `pipe` is True, renderers
+    that can take the SVG through stdin and give back the PNG through
+    stdout are used that way. Otherwise the SVG is rendered to `png_out`,
+    which creates and deletes a temporary SVG file next to it.
+
+    If an InkscapeShellPool is given as `shells`, the render is sent to one
+    of its Inkscape processes instead of starting a new rasteriser.
     """
-    tmp_svg_path = '.tmp' + name + '.svg'
-    tmp_png_path = '.tmp' + name + '.png'
+    if renderer == 'cairosvg':
+        return RenderedPng(png_out, image_proc.render_svg_to_bytes(emoji_svg, size))
+
+    if pipe and not shells and renderer in image_proc.PIPE_RENDERERS:
+        return RenderedPng(png_out, image_proc.render_svg_pipe(emoji_svg, renderer, size))
+
+    tmp_svg_path = os.path.splitext(png_out)[0] + '.svg'
 
     # try to write a temporary SVG.
     files.try_write(emoji_svg, tmp_svg_path, "temporary SVG")
 
+    try:
+        if shells:
+            shells.render(tmp_svg_path, png_out, size)
+        else:
+            image_proc.render_svg(tmp_svg_path, png_out, renderer, size)
+    finally:
+        os.remove(tmp_svg_path)
+
+    return RenderedPng(png_out)
+
 
-    if format == "png":
-        # one-step process
-        image_proc.render_svg(tmp_svg_path, out_path, renderer, size)
 
-    else:
-        # two-step process
-        image_proc.render_svg(tmp_svg_path, tmp_png_path, renderer, size)
-
-        if format == "pngc":
-            image_proc.crush_png(tmp_png_path, out_path)
-        elif format == "webp":
-            image_proc.convert_webp(tmp_png_path, out_path)
-        elif format == "jxl":
-            image_proc.convert_jxl(tmp_png_path, out_path)
-        else:
-            os.remove(tmp_svg_path)
-            os.remove(tmp_png_path)
-            raise ValueError(f"This function wasn't given a correct format! ({format})")
 
+def to_raster(render, out_path, format, pipe=False, png_license=None):
+    """
+    Raster exporting function. Can export to any of orxporter's supported raster formats.
+    Takes an already rendered PNG of the emoji (at the right size) and
+    converts it into the requested format.
 
-    # delete temporary files
-    os.remove(tmp_svg_path)
+    If `pipe` is True, the render is piped into converters that support it
+    (cwebp) instead of them reading it from a file.
 
-    if format != "png":
-        os.remove(tmp_png_path)
+    pngc is written out like png; it gets crushed afterwards in batches
+    (see image_proc.batch_crush_png()). If `png_license` is given, those
+    license chunks are written into png and pngc files.
+    """
+    if format in ("png", "pngc"):
+        # the render already is the final PNG.
+        if png_license:
+            files.try_write(png_metadata.add_chunks(render.bytes(), png_license),
+                            out_path, "final PNG")
+        elif render.on_disk:
+            shutil.copyfile(render.file(), out_path)
+        else:
+            files.try_write(render.bytes(), out_path, "final PNG")
+    elif format == "webp":
+        if pipe:
+            image_proc.convert_webp(None, out_path, render.bytes())
+        else:
+            image_proc.convert_webp(render.file(), out_path)
+    elif format == "jxl":
+        image_proc.convert_jxl(render.file(), out_path)
+    else:
+        raise ValueError(f"This function wasn't given a correct format! ({format})")
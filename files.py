@@ -1,4 +1,28 @@
 import os
+import shutil
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # (not on Windows, which doesn't do reflinks anyway.)
+    fcntl = None
+
+
+
+"""The ioctl that makes a reflink (a copy-on-write clone) of a file on Linux."""
+_FICLONE = 0x40049409
+
+"""
+The ways a file can be put in place by link_file(), cheapest first.
+- symlink: a symbolic link to the original file
+- hardlink: another name for the original file
+- reflink: a copy that shares its data with the original until either
+  is changed (only on filesystems like Btrfs and XFS)
+- copy: a plain copy
+"""
+LINK_METHODS = ('symlink', 'hardlink', 'reflink', 'copy')
 
 def try_write(data, out_path, obj_name):
     """
@@ -6,12 +30,133 @@ def try_write(data, out_path, obj_name):
 
     'obj_name' is a name to give the thing you're trying to export so that
     if it fails, the error message that's given is more specific.
+
+    'data' can be either a string or bytes.
     """
 
     try:
-        f = open(out_path, 'w')
+        f = open(out_path, 'wb' if isinstance(data, bytes) else 'w')
         f.write(data)
         f.close()
 
     except IOError as e:
         raise Exception(f"Could not write {obj_name} to path '{out_path}'. More info: {e}")
+
+
+
+
+def make_scratch_dir():
+    """
+    Makes a directory for temporary files, on a tmpfs (/dev/shm) if
+    there is one, and otherwise in the system's temporary directory.
+    Returns its path.
+    """
+    base = None
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        base = '/dev/shm'
+
+    try:
+        return tempfile.mkdtemp(prefix='orxporter-', dir=base)
+    except OSError as e:
+        raise Exception(f"Could not make a scratch directory for temporary files. More info: {e}")
+
+
+
+
+def _reflink(src, dest):
+    """
+    Makes a reflink of `src` at `dest`, raising OSError if the filesystem
+    doesn't support them.
+    """
+    if fcntl is None:
+        raise OSError("reflinks aren't supported on this platform")
+
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+        try:
+            fcntl.ioctl(fdest.fileno(), _FICLONE, fsrc.fileno())
+        except OSError:
+            fdest.close()
+            os.remove(dest)
+            raise
+
+
+
+def link_file(src, dest, method='copy', editable=False):
+    """
+    Puts the file at `src` at `dest` too, by one of the LINK_METHODS. If the
+    filesystem doesn't support that method, the next (more expensive) ones
+    are tried, ending with a plain copy.
+
+    If the file at `dest` is going to be changed afterwards (`editable`), it
+    is only ever reflinked or copied, so the change can't reach `src`.
+
+    Anything already at `dest` is removed first, so that a file linked
+    there before is never written through. Returns the method that was used.
+    """
+    methods = LINK_METHODS[LINK_METHODS.index(method):]
+    if editable:
+        methods = [m for m in methods if m in ('reflink', 'copy')]
+
+    if os.path.lexists(dest):
+        os.remove(dest)
+
+    for link_method in methods:
+        try:
+            if link_method == 'symlink':
+                os.symlink(os.path.abspath(src), dest)
+            elif link_method == 'hardlink':
+                os.link(src, dest)
+            elif link_method == 'reflink':
+                _reflink(src, dest)
+            else:
+                shutil.copy(src, dest)
+            return link_method
+        except OSError:
+            # (copy is always the last method, and it has nothing to fall
+            # back on.)
+            if link_method == 'copy':
+                raise
+
+
+
+def temp_path_for(path):
+    """
+    Gets a path for a temporary file next to `path` (so it can be renamed
+    over `path` atomically) that no other process or thread will use.
+    """
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, f'.{basename}.{os.getpid()}-'
+                                 f'{threading.get_ident()}.tmp')
+
+
+
+def write_atomic(path, write):
+    """
+    Writes a file by calling `write` with a temporary path next to it, then
+    renaming that over `path`, so other processes only ever see either
+    the old file or the complete new one.
+    """
+    temp_path = temp_path_for(path)
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+
+def unshare(path):
+    """
+    Removes the file at `path` if it's linked to another file (ie. a
+    hardlink or symlink into the cache), so writing a new file there
+    can't change the other one.
+    """
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+
+    if os.path.islink(path) or st.st_nlink > 1:
+        os.remove(path)
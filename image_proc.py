@@ -2,6 +2,15 @@ import os
 import pathlib
 import subprocess
 
+# cairosvg is optional - it's only needed for the 'cairosvg' renderer.
+# (it raises OSError if it's installed but the cairo library isn't.)
+try:
+    import cairosvg
+except (ImportError, OSError):
+    cairosvg = None
+
+"""Renderers that can be used with render_svg_pipe()."""
+PIPE_RENDERERS = ('inkscape', 'resvg', 'imagemagick')
 
 
 def render_svg(svg_in, png_out, renderer, size):
@@ -36,15 +45,73 @@ def render_svg(svg_in, png_out, renderer, size):
 
 
 
-def convert_webp(png_in, webp_out):
+def render_svg_pipe(emoji_svg, renderer, size):
+    """
+    Renders an SVG (as a string) to PNG data by piping it through the
+    rasteriser's stdin and stdout, without any files.
+    (Only for renderers that support it, see PIPE_RENDERERS.)
+    """
+
+    if renderer == 'inkscape':
+        cmd = ['inkscape', '--pipe', '--export-type=png', '--export-filename=-',
+               '-h', str(size), '-w', str(size)]
+
+    elif renderer == 'resvg':
+        cmd = ['resvg', '-w', str(size), '-h', str(size), '-', '-c']
+
+    elif renderer == 'imagemagick':
+        cmd = ['convert', '-background', 'none', '-density', str(size / 32 * 128),
+               '-resize', str(size) + 'x' + str(size), 'svg:-', 'png:-']
+    else:
+        raise AssertionError
+
+
+    try:
+        r = subprocess.run(cmd, input=emoji_svg.encode('utf-8'),
+                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    except Exception as e:
+        raise Exception('Rasteriser invocation failed: ' + str(e))
+    if r.returncode:
+        raise Exception('Rasteriser returned error code: ' + str(r.returncode))
+    if not r.stdout:
+        raise Exception('Rasteriser returned no image.')
+
+    return r.stdout
+
+
+
+
+def render_svg_to_bytes(emoji_svg, size):
+    """
+    Renders an SVG (as a string) to PNG data in memory with cairosvg,
+    without starting a rasteriser or writing any files.
+    """
+    if cairosvg is None:
+        raise Exception("The cairosvg renderer needs the 'cairosvg' Python package to be installed.")
+
+    try:
+        return cairosvg.svg2png(bytestring=emoji_svg.encode('utf-8'),
+                                output_width=size, output_height=size)
+    except Exception as e:
+        raise Exception('Rasteriser (cairosvg) failed: ' + str(e))
+
+
+
+
+def convert_webp(png_in, webp_out, png_data=None):
     """
     Converts a PNG at `png_in` to a Lossless WebP at `webp_out`.
+    If `png_data` is given instead, it's piped into the converter.
     Will raise an exception if trying to invoke the converter failed.
     """
-    cmd = ['cwebp', '-lossless', '-quiet', os.path.abspath(png_in), '-o', os.path.abspath(webp_out)]
+    if png_data is None:
+        cmd = ['cwebp', '-lossless', '-quiet', os.path.abspath(png_in), '-o', os.path.abspath(webp_out)]
+    else:
+        cmd = ['cwebp', '-lossless', '-quiet', '-o', os.path.abspath(webp_out), '--', '-']
 
     try:
-        r = subprocess.run(cmd, stdout=subprocess.DEVNULL).returncode
+        r = subprocess.run(cmd, input=png_data, stdout=subprocess.DEVNULL).returncode
     except Exception as e:
         raise Exception('Invoking the WebP converter (cwebp) failed: ' + str(e))
     if r:
@@ -70,42 +137,25 @@ def convert_jxl(png_in, jxl_out):
         raise Exception('The JXL converter returned the following: ' + str(r))
 
 
-def crush_png(png_in, pngc_out):
-    """
-    Crushes a single PNG at `png_in` to `png_out`.
-    Will raise an exception if trying to invoke the optimiser failed.
-    """
-    cmd = ['oxipng', os.path.abspath(png_in), '--out', os.path.abspath(pngc_out), '--quiet']
-
-    try:
-        r = subprocess.run(cmd, stdout=subprocess.DEVNULL).returncode
-    except Exception as e:
-        raise Exception('Invoking the PNG crusher (oxipng) failed: ' + str(e))
-    if r:
-        raise Exception('The PNG crusher returned the following: ' + str(r))
-
-
-
-def batch_add_exif_metadata(paths, metadata, max_batch=1000):
+def batch_crush_png(paths, max_batch=1000, threads=None):
     """
-    Adds EXIF license metadata to an image file in batches.
-    (This is done in batches because exiftool is far more performant
-    this way than if it was done invidually)
+    Crushes PNG files in place, in batches.
+    (This is done in batches because oxipng can spread a batch of files
+    over its own threads, instead of being started again for every file)
 
-    'paths' is a list of paths of image files to have EXIF
-    metadata applied to them.
+    'paths' is a list of paths of PNG files to crush.
 
     'max_batch' is how many input images you can feed in one command
     because some operating systems have different restrictions.
-    """
-
-    cmd = ['exiftool']
 
-    for tag, val in metadata.items():
-        cmd.append('-{}={}'.format(tag, val))
+    'threads' is how many threads oxipng uses for each batch
+    (by default, oxipng decides).
+    """
 
-    cmd.append('-overwrite_original')
-    remaining = list(paths)
+    cmd = ['oxipng', '--quiet']
+    if threads:
+        cmd += ['--threads', str(threads)]
+    remaining = [os.path.abspath(p) for p in paths]
 
     while remaining:
         batch, remaining = remaining[:max_batch], remaining[max_batch:]
@@ -113,6 +163,6 @@ def batch_add_exif_metadata(paths, metadata, max_batch=1000):
             r = subprocess.run(cmd + batch,
                                stdout=subprocess.DEVNULL).returncode
         except Exception as e:
-            raise Exception('Invoking the EXIF metadata embedding tool (exiftool) failed: ' + str(e))
+            raise Exception('Invoking the PNG crusher (oxipng) failed: ' + str(e))
         if r:
-            raise Exception('exiftool returned error code: ' + str(r))
+            raise Exception('The PNG crusher returned the following: ' + str(r))
@@ -0,0 +1,179 @@
+import os
+import queue
+import subprocess
+import threading
+
+
+
+class InkscapeShell:
+    """
+    A single long-lived Inkscape process running in shell mode
+    (`inkscape --shell`), that SVGs can be sent to for rendering.
+
+    This saves starting a new Inkscape for every file, which takes most of
+    the time when rendering at small sizes. If the process dies, or doesn't
+    answer within `timeout` seconds (when it's killed), it is restarted for
+    the next render.
+    """
+
+    PROMPT = b'> '
+
+    # How long (in seconds) Inkscape has to start, and to do each render
+    start_timeout = 180
+    timeout = 60
+
+    def __init__(self):
+        self.proc = None
+
+
+    def start(self):
+        """
+        Starts the Inkscape process and waits for it to be ready.
+        """
+        try:
+            self.proc = subprocess.Popen(['inkscape', '--shell'],
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL)
+        except Exception as e:
+            raise Exception('Rasteriser invocation failed: ' + str(e))
+
+        self.wait_for_prompt(self.start_timeout)
+
+
+    def stop(self):
+        """
+        Asks the Inkscape process to quit (or kills it if it won't).
+        """
+        if self.proc is None:
+            return
+
+        try:
+            self.proc.stdin.write(b'quit\n')
+            self.proc.stdin.flush()
+            self.proc.wait(timeout=5)
+        except Exception:
+            self.proc.kill()
+            self.proc.wait()
+
+        self.proc = None
+
+
+    def alive(self):
+        """
+        Returns True if the Inkscape process is running.
+        """
+        return self.proc is not None and self.proc.poll() is None
+
+
+    def wait_for_prompt(self, timeout):
+        """
+        Reads Inkscape's output until it asks for the next command, killing
+        it if that takes longer than `timeout` seconds.
+        """
+        # (the read can't be given a deadline itself, so a watchdog kills
+        # the process, which ends the read.)
+        timed_out = threading.Event()
+        proc = self.proc
+
+        def kill():
+            timed_out.set()
+            proc.kill()
+
+        watchdog = threading.Timer(timeout, kill)
+        watchdog.start()
+        try:
+            out = b''
+            while not out.endswith(self.PROMPT):
+                c = proc.stdout.read(1)
+                if not c:
+                    if timed_out.is_set():
+                        raise Exception('Inkscape shell stopped responding '
+                                        f'(for {timeout} seconds)')
+                    raise Exception('Inkscape shell stopped unexpectedly (returned '
+                                    f'{proc.poll()})')
+                out += c
+        finally:
+            watchdog.cancel()
+
+
+    def send(self, command):
+        """
+        Sends a single line of actions to the Inkscape shell and waits for
+        them to be done.
+        """
+        self.proc.stdin.write(command.encode('utf-8') + b'\n')
+        self.proc.stdin.flush()
+        self.wait_for_prompt(self.timeout)
+
+
+    def render(self, svg_in, png_out, size):
+        """
+        Renders a single SVG to a PNG, (re)starting Inkscape if needed.
+        """
+        png_out = os.path.abspath(png_out)
+        command = ';'.join([f'file-open:{os.path.abspath(svg_in)}',
+                            f'export-filename:{png_out}',
+                            f'export-width:{size}',
+                            f'export-height:{size}',
+                            'export-do',
+                            'file-close'])
+
+        if os.path.exists(png_out):
+            os.remove(png_out)
+
+        if not self.alive():
+            self.start()
+
+        try:
+            self.send(command)
+        except Exception:
+            # the process has crashed or stopped talking to us;
+            # get rid of it so that the next render starts a new one.
+            self.stop()
+            raise
+
+        if not os.path.exists(png_out):
+            raise Exception('Inkscape shell did not render ' + svg_in)
+
+
+
+class InkscapeShellPool:
+    """
+    A fixed number of InkscapeShells that export threads borrow for each
+    render, so that there's one Inkscape for each thread working at a time.
+    """
+
+    def __init__(self, size):
+        self.shells = queue.Queue()
+        self.all_shells = []
+
+        for i in range(size):
+            shell = InkscapeShell()
+            self.all_shells.append(shell)
+            self.shells.put(shell)
+
+
+    def render(self, svg_in, png_out, size):
+        """
+        Renders a single SVG to a PNG with one of the shells in the pool.
+
+        If the shell crashes or stops responding during the render, it gets
+        restarted and the render is tried once more.
+        """
+        shell = self.shells.get()
+        try:
+            try:
+                shell.render(svg_in, png_out, size)
+            except Exception:
+                shell.render(svg_in, png_out, size)
+        finally:
+            self.shells.put(shell)
+
+
+    def close(self):
+        """
+        Stops all of the Inkscape processes in the pool.
+        """
+        for shell in self.all_shells:
+            shell.stop()
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+
+import util
+
+
+
+class Journal:
+    """
+    An append-only record of the export tasks that have been finished,
+    so that an interrupted export can be resumed (with --resume) without
+    doing those tasks again.
+
+    Every line of the journal file is a JSON object for a single finished
+    task, with:
+      - the path of the exported file and its format;
+      - the size and modification time of the exported file, so that
+        outputs that were changed or cut off since are done again (without
+        having to read them);
+      - a stamp of everything that went into the export (see stamp()), so
+        that tasks whose source, palettes, license or renderer changed
+        after they were recorded are done again.
+
+    A run without --resume starts a new journal.
+    """
+
+    def __init__(self, path, m, input_path, resume=False, renderer=None,
+                 license_enabled=True):
+        self.path = path
+        self.m = m
+        self.input_path = input_path
+        self.renderer = renderer
+        self.license_enabled = license_enabled
+        self.done = {}
+
+        if resume and os.path.exists(path):
+            self.load()
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        try:
+            self.file = open(path, 'a' if resume else 'w')
+        except OSError as e:
+            raise Exception(f"Could not open the export journal '{path}'. More info: {e}")
+
+
+    def load(self):
+        """
+        Reads the entries of an existing journal file.
+        """
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line might be half-written if the
+                    # export was stopped while writing it.
+                    continue
+                self.done[(entry['path'], entry['format'])] = entry
+
+
+    def stamp(self, emoji, f):
+        """
+        Gets a hash of everything that went into exporting an emoji as the
+        format `f`: its source (by its cache key if it has one, otherwise by
+        the source file's size and modification time), its palettes, the
+        license of the format and the renderer.
+        """
+        if 'cache_keys' in emoji:
+            source = emoji['cache_keys']['base']
+        else:
+            srcpath = os.path.join(self.m.homedir, self.input_path, emoji['src'])
+            st = os.stat(srcpath)
+            source = (st.st_size, st.st_mtime_ns)
+
+        license = None
+        if self.license_enabled:
+            license = self.m.license.get(util.get_license_type_for_format(f))
+
+        parts = (
+            ('source', source),
+            ('palettes', util.get_color_palettes(emoji, self.m)),
+            ('license', license),
+            ('renderer', self.renderer if f != 'svg' else None),
+        )
+        return hashlib.sha256(bytes(repr(parts), 'utf-8')).hexdigest()
+
+
+    @staticmethod
+    def output_stamp(final_path):
+        """
+        Gets the size and modification time of an exported file.
+        """
+        st = os.stat(final_path)
+        return [st.st_size, st.st_mtime_ns]
+
+
+    def is_done(self, emoji, f, final_path):
+        """
+        Returns True if the journal has a finished task for this emoji and
+        format, whose output hasn't changed since and that would be
+        exported the same way now.
+        """
+        entry = self.done.get((final_path, f))
+        if entry is None:
+            return False
+
+        try:
+            return (entry.get('output') == self.output_stamp(final_path) and
+                    entry.get('stamp') == self.stamp(emoji, f))
+        except OSError:
+            return False
+
+
+    def record(self, emoji, f, final_path):
+        """
+        Adds a finished task to the journal.
+        """
+        entry = {
+            'short': emoji.get('short'),
+            'format': f,
+            'path': final_path,
+            'output': self.output_stamp(final_path),
+            'stamp': self.stamp(emoji, f),
+        }
+
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        self.done[(final_path, f)] = entry
+
+
+    def close(self, finished=False):
+        """
+        Closes the journal file. If the export `finished`, the journal isn't
+        needed anymore and is deleted.
+        """
+        self.file.close()
+        if finished:
+            os.remove(self.path)
@@ -26,5 +26,4 @@ thread_color = 34
 
 
 # stuff for progress bars
-export_task_count = 0
 filtered_export_task_count = 0
@@ -13,6 +13,7 @@ class Parameters(Orx):
         self.homedir = homedir
         self.defines = {}
         self.dests = []
+        self.limits = {}
 
         # get the actual data for this stuff
         if filename is not None:
@@ -54,6 +55,19 @@ class Parameters(Orx):
 
 
 
+    def exec_limits(self, args, kwargs):
+        """
+        Executes an orx parameters `limits` statement.
+        (ie. `limits render = 4 cjxl = 2`)
+        """
+        if args:
+            raise ValueError("limits only takes name = number values")
+
+        self.limits.update(kwargs)
+
+
+
+
     def exec_expr(self, expr):
         """
         Executes an orx parameters expression.
@@ -86,6 +100,8 @@ class Parameters(Orx):
 
         elif head == 'dest':
             self.exec_dest(args, kwargs)
+        elif head == 'limits':
+            self.exec_limits(args, kwargs)
 
         else:
             raise ValueError('Unknown expression type: ' + head)
@@ -6,16 +6,22 @@ import sys
 
 import emoji
 import export
+import export_executor
+import image_proc
 import jsonutils
 import log
 
 import orx.manifest
 import orx.params
-from cache import Cache
+from cache import Cache, parse_size
+from cache_backend import PackBackend
+from journal import Journal
+import shard as sharding
+from timings import Timings
 
 VERSION = '0.5.0'
 
-RENDERERS = ['inkscape', 'resvg', 'imagemagick']
+RENDERERS = ['inkscape', 'inkscape-shell', 'resvg', 'imagemagick', 'cairosvg']
 
 DEF_INPUT = 'in'
 DEF_MANIFEST = 'manifest.orx'
@@ -30,6 +36,9 @@ DEF_NUM_THREADS = 1
 DEF_RENDERER = 'inkscape'
 DEF_MAX_BATCH = 1000
 
+JOURNAL_NAME = '.orxporter_journal'
+TIMINGS_NAME = '.orxporter_timings.json'
+
 HELP = f'''orxporter {VERSION}
 by Mutant Standard
 (mutant.tech)
@@ -67,6 +76,8 @@ IMAGE BUILD:
         - resvg
         - imagemagick
         - inkscape
+        - inkscape-shell (keeps an Inkscape 1.x running for each thread)
+        - cairosvg (renders in memory, needs the cairosvg Python package)
 
 -l      Do not embed license metadata given in manifest
 
@@ -76,8 +87,80 @@ IMAGE BUILD:
 
 -t      Number of threads working on export tasks (default: {DEF_NUM_THREADS})
 
+--limits <NAME=NUM,...>
+        Concurrency limits for parts of the export, comma separated
+        (ie. 'render=8,cjxl=2'). Each one defaults to -t.
+        - tasks (export tasks worked on at once)
+        - render (SVG renders at once)
+        - cwebp, cjxl (encoders running at once)
+        - oxipng (threads used by each oxipng batch, default: all cores)
+        - io (file reads and writes at once)
+        - exiftool (exiftool processes adding EXIF metadata at once)
+        These can also be given in a parameters file with a 'limits'
+        statement, which overrides this flag.
+
+--resume
+        Resume an export that was stopped or crashed, skipping the tasks
+        it finished (as recorded in '{JOURNAL_NAME}' in the output directory).
+
+--timings <FILE>
+        Where to keep how long each format took in previous exports, which
+        is used to start the longest tasks first and to estimate how long
+        an export will take (default: '{TIMINGS_NAME}' in the cache
+        directory if -C is a directory, otherwise in the current directory).
+
+--shard <K/N>
+        Only export the Kth of N shards of the emoji set (ie. '2/4'), so that
+        an export can be split between several machines or processes.
+        Every shard is about as much work as the others.
+
+--merge <DIR,...>
+        Merge the output directories of several shards into the output
+        directory (-o), instead of exporting anything.
+
+--merge-cache <DIR,...>
+        Merge the cache directories of several shards into the cache
+        directory (-C), instead of exporting anything.
+
+--pipe  Pipe images through stdin/stdout of the renderer and converters
+        where they support it, and keep any other temporary files in a
+        scratch directory (on /dev/shm if possible) instead of the
+        current directory.
+
 -C      Cache directory
         Uses the argument as the directory for the export cache.
+        This can also be the URL of a cache server (ie. 'http://host:8765',
+        see cache_server.py), so that several machines can share a cache.
+
+--cache-link <METHOD>
+        How files are taken out of (and put into) the cache (default: copy).
+        If the filesystem can't do it, the next method down is used.
+        - symlink
+        - hardlink
+        - reflink (copy-on-write, ie. on Btrfs or XFS)
+        - copy
+        Files that get EXIF metadata added after they're exported are only
+        ever reflinked or copied, so the cache is never changed through them.
+
+--cache-pack
+        Keep the cache directory in a few big pack files instead of a file
+        for every export. (A cache directory that already has pack files
+        always uses them; pack_cache.py converts a cache directory.)
+
+--cache-max-size <SIZE>
+        Maximum size of the cache (ie. '500M', '2G'). At the end of an export,
+        the files that were used longest ago are removed until the cache fits.
+        (Symlinked exports pointing at removed files will be broken.)
+
+--cache-gc
+        Instead of exporting, remove every file from the cache (-C) that no
+        emoji in the manifest uses anymore (ie. after source or palette
+        changes), then apply --cache-max-size if it's given.
+
+--cache-stats <FILE>
+        Also write the cache statistics printed at the end of an export
+        (hits, misses, bytes and time spent restoring and storing files,
+        by format) to a JSON file.
 
 
 JSON BUILD:
@@ -92,7 +175,7 @@ OTHER OPTIONS:
 ----------------------------------------------------
 -e <FILTER>             emoji filter
 -q <WIDTHxHEIGHT>       ensure source images have certain size
--b <NUM>                maximum files per exiftool call (default: {DEF_MAX_BATCH})
+-b <NUM>                maximum files per exiftool/oxipng call (default: {DEF_MAX_BATCH})
 --force-desc            ensure all emoji have a text description
 
 TERMINAL OPTIONS:
@@ -118,14 +201,30 @@ def main():
     json_web_out = None
     src_size = None
     num_threads = DEF_NUM_THREADS
+    given_limits = {}
     force_desc = False
     max_batch = DEF_MAX_BATCH
     cache = False
+    cache_dir = None
+    cache_link = 'copy'
+    cache_max_size = None
+    cache_gc = False
+    cache_stats_path = None
+    cache_pack = False
+    pipe = False
+    resume = False
+    timings_path = None
+    shard = None
+    merge_dirs = []
+    merge_cache_dirs = []
     verbose = False
     try:
         opts, _ = getopt.getopt(sys.argv[1:],
                                 'hm:i:o:f:F:ce:j:J:q:t:r:b:p:lC:',
-                                ['help', 'force-desc', 'verbose'])
+                                ['help', 'force-desc', 'verbose', 'pipe', 'resume', 'limits=', 'timings=', 'shard=',
+                                 'merge=', 'merge-cache=', 'cache-link=',
+                                 'cache-max-size=', 'cache-gc', 'cache-stats=',
+                                 'cache-pack'])
 
 
         for opt, arg in opts:
@@ -157,7 +256,33 @@ def main():
                 if num_threads <= 0:
                     raise ValueError
             elif opt == '-C':
-                cache = Cache(cache_dir=arg)
+                cache_dir = arg
+            elif opt == '--cache-link':
+                cache_link = arg
+            elif opt == '--cache-max-size':
+                cache_max_size = parse_size(arg)
+            elif opt == '--cache-gc':
+                cache_gc = True
+            elif opt == '--cache-stats':
+                cache_stats_path = arg
+            elif opt == '--cache-pack':
+                cache_pack = True
+            elif opt == '--limits':
+                for limit in arg.split(','):
+                    k, v = limit.split('=')
+                    given_limits[k] = v
+            elif opt == '--pipe':
+                pipe = True
+            elif opt == '--resume':
+                resume = True
+            elif opt == '--timings':
+                timings_path = arg
+            elif opt == '--shard':
+                shard = sharding.parse_shard(arg)
+            elif opt == '--merge':
+                merge_dirs = arg.split(',')
+            elif opt == '--merge-cache':
+                merge_cache_dirs = arg.split(',')
 
 
             # JSON
@@ -188,6 +313,13 @@ def main():
             elif opt == '--verbose':
                 verbose = True
 
+        # (made after the loop, so -C can come before or after --cache-link.)
+        if cache_dir:
+            cache = Cache(cache_dir=cache_dir, link=cache_link,
+                          max_size=cache_max_size,
+                          stats_path=cache_stats_path,
+                          pack=cache_pack)
+
     except Exception as e:
         log.out(f'x∆∆x {e}\n', 31)
         sys.exit(2)
@@ -204,7 +336,26 @@ def main():
         # validate basic input that can't be checked while in progress
         if renderer not in RENDERERS:
             raise Exception(f"There's a mistake in your command arguments. '{renderer}' is not a renderer you can use in orxporter.")
+        if renderer == 'cairosvg' and image_proc.cairosvg is None:
+            raise Exception("To use the cairosvg renderer, you need to install the 'cairosvg' Python package (pip install cairosvg).")
+
 
+        # merging shards doesn't need a manifest, so do that and stop there.
+        if merge_dirs or merge_cache_dirs:
+            if merge_dirs:
+                log.out(f'Merging {len(merge_dirs)} shard output directories into \'{output_path}\'...', 36)
+                log.out(f'-> {sharding.merge_trees(merge_dirs, output_path)} files')
+            if merge_cache_dirs:
+                if not cache or not cache.backend.local:
+                    raise ValueError("You need to give a cache directory (-C) to merge shard caches into.")
+                if isinstance(cache.backend, PackBackend) or \
+                        any(os.path.isdir(os.path.join(d, PackBackend.pack_dir_name))
+                            for d in merge_cache_dirs):
+                    raise ValueError("Pack caches (--cache-pack) can't be merged. Merge the shards' cache directories first, then convert the result with pack_cache.py.")
+                log.out(f'Merging {len(merge_cache_dirs)} shard cache directories into \'{cache.cache_dir}\'...', 36)
+                log.out(f'-> {sharding.merge_trees(merge_cache_dirs, cache.cache_dir)} files')
+            log.out('All done! ^∆∆^\n', 32) # goodbye
+            return
 
 
 
@@ -233,8 +384,20 @@ def main():
 
 
 
+        # clean the cache up instead of exporting
+        if cache_gc:
+            if not cache:
+                raise ValueError("You need to give a cache directory (-C) to clean up.")
+            log.out(f'Removing cache files that no emoji in the manifest uses...', 36)
+            removed_count, freed = cache.gc(m, m.emoji, input_path)
+            log.out(f'-> {removed_count} files ({freed / 1024 ** 2:.1f} MiB)')
+            if cache.max_size:
+                log.out(f'Evicting the least recently used files from the cache...', 36)
+                evicted_count, freed = cache.evict()
+                log.out(f'-> {evicted_count} files ({freed / 1024 ** 2:.1f} MiB)')
+
         # JSON out or image out
-        if json_out:
+        elif json_out:
             jsonutils.write_emoji(filtered_emoji, json_out)
         elif json_web_out:
             jsonutils.write_web(filtered_emoji, json_web_out)
@@ -257,14 +420,29 @@ def main():
 
             path = os.path.join(output_path, output_naming)
 
+            given_limits.update(p.limits)
+            limits = export_executor.get_limits(num_threads, given_limits)
+
             log.out(f'{len(p.dests)} destination(s) defined.', 32)
             log.out(f"-> {', '.join(output_formats)}") # print formats
             log.out(f"-> to '{path}'") # print out path
 
+            journal = Journal(os.path.join(output_path, JOURNAL_NAME), m,
+                              input_path, resume, renderer, license_enabled)
+            # (the timings are kept out of the output, so they don't end up
+            # in a release.)
+            if not timings_path:
+                timings_dir = ''
+                if cache and cache.backend.local:
+                    timings_dir = cache.cache_dir
+                timings_path = os.path.join(timings_dir, TIMINGS_NAME)
+            timings = Timings(timings_path)
+
             export.export(m, filtered_emoji, input_path, output_formats,
                           path, src_size,
-                          num_threads, renderer, max_batch, verbose,
-                          license_enabled, cache)
+                          limits, renderer, max_batch, verbose,
+                          license_enabled, cache, pipe, journal, timings,
+                          shard)
 
 
 
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Converts a cache directory (a file for every export) into a pack cache
+(a few big pack files with an index; see orxporter's --cache-pack).
+
+Every cached file is appended to the packs and then removed, along with
+the emptied format directories. Don't use the cache while it's converted.
+
+USAGE: pack_cache.py <cache directory>
+"""
+
+import os
+import sys
+
+from cache_backend import DirectoryBackend, PackBackend
+
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(2)
+
+    cache_dir = sys.argv[1]
+    if not os.path.isdir(cache_dir):
+        print(f"'{cache_dir}' isn't a cache directory.")
+        sys.exit(1)
+
+    # (leaving out temporary files left behind by stopped orxporters.)
+    entries = [entry for entry in DirectoryBackend(cache_dir).get_entries()
+               if not entry[1].startswith('.')]
+    pack = PackBackend(cache_dir)
+
+    print(f"Packing {len(entries)} files...")
+    packed_bytes = 0
+    for f, key, _, _ in entries:
+        path = os.path.join(cache_dir, f, key)
+        with open(path, 'rb') as cache_file:
+            packed_bytes += pack.put_data(f, key, cache_file.read())
+        os.remove(path)
+
+    # remove the format directories (if nothing else is in them)
+    for f in set(f for f, _, _, _ in entries):
+        try:
+            os.rmdir(os.path.join(cache_dir, f))
+        except OSError:
+            pass
+
+    print(f"-> {packed_bytes / 1024 ** 2:.1f} MiB in "
+          f"{pack.newest_pack()} pack file(s)")
+
+
+
+if __name__ == '__main__':
+    main()
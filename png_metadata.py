@@ -0,0 +1,231 @@
+import struct
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+
+import files
+
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+"""The iTXt keyword that XMP packets are stored under."""
+XMP_KEYWORD = b'XML:com.adobe.xmp'
+
+"""
+EXIF tags (by their exiftool name, in lowercase) that can be written
+natively, and their IDs. These are all ASCII tags in IFD0.
+"""
+_exif_tags = {
+    'documentname': 0x010d,
+    'imagedescription': 0x010e,
+    'make': 0x010f,
+    'model': 0x0110,
+    'software': 0x0131,
+    'artist': 0x013b,
+    'hostcomputer': 0x013c,
+    'copyright': 0x8298,
+}
+
+"""The exiftool groups that _exif_tags can be given with."""
+_exif_groups = ('', 'exif', 'ifd0')
+
+"""XMP namespaces (by their exiftool group name) and their prefixes and URIs."""
+_xmp_namespaces = {
+    'xmp-dc': ('dc', 'http://purl.org/dc/elements/1.1/'),
+    'xmp-xmprights': ('xmpRights', 'http://ns.adobe.com/xap/1.0/rights/'),
+    'xmp-cc': ('cc', 'http://creativecommons.org/ns#'),
+    'xmp-photoshop': ('photoshop', 'http://ns.adobe.com/photoshop/1.0/'),
+}
+
+"""
+XMP properties that can be written natively, keyed by their exiftool group
+and tag name (in lowercase), with their actual property name and how the
+value is written:
+- text: a simple value
+- uri: a link (rdf:resource)
+- lang-alt: a value in the default language
+- seq, bag: a list with the value as its only item
+"""
+_xmp_properties = {
+    ('xmp-dc', 'contributor'): ('contributor', 'bag'),
+    ('xmp-dc', 'creator'): ('creator', 'seq'),
+    ('xmp-dc', 'description'): ('description', 'lang-alt'),
+    ('xmp-dc', 'publisher'): ('publisher', 'bag'),
+    ('xmp-dc', 'rights'): ('rights', 'lang-alt'),
+    ('xmp-dc', 'source'): ('source', 'text'),
+    ('xmp-dc', 'subject'): ('subject', 'bag'),
+    ('xmp-dc', 'title'): ('title', 'lang-alt'),
+    ('xmp-xmprights', 'marked'): ('Marked', 'text'),
+    ('xmp-xmprights', 'owner'): ('Owner', 'bag'),
+    ('xmp-xmprights', 'usageterms'): ('UsageTerms', 'lang-alt'),
+    ('xmp-xmprights', 'webstatement'): ('WebStatement', 'text'),
+    ('xmp-cc', 'attributionname'): ('attributionName', 'text'),
+    ('xmp-cc', 'attributionurl'): ('attributionURL', 'uri'),
+    ('xmp-cc', 'license'): ('license', 'uri'),
+    ('xmp-cc', 'morepermissions'): ('morePermissions', 'uri'),
+    ('xmp-photoshop', 'credit'): ('Credit', 'text'),
+    ('xmp-photoshop', 'source'): ('Source', 'text'),
+}
+
+
+
+def make_chunk(chunk_type, data):
+    """
+    Makes a single PNG chunk (length, type, data and CRC).
+    """
+    return (struct.pack('>I', len(data)) + chunk_type + data
+            + struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+
+
+def make_exif(tags):
+    """
+    Makes the contents of an eXIf chunk (a big-endian TIFF structure with
+    a single IFD) from a dict of tag ID: ASCII value.
+    """
+    entry_count = len(tags)
+    # (header, then the entry count, the entries and the next IFD offset.)
+    data_offset = 8 + 2 + entry_count * 12 + 4
+
+    entries = b''
+    values = b''
+    for tag_id, value in sorted(tags.items()):
+        value = value.encode('utf-8') + b'\0'
+
+        # values of 4 bytes or less go in the entry itself.
+        if len(value) <= 4:
+            entries += struct.pack('>HHI4s', tag_id, 2, len(value), value)
+        else:
+            entries += struct.pack('>HHII', tag_id, 2, len(value),
+                                   data_offset + len(values))
+            values += value
+            # (values are meant to start on an even offset.)
+            if len(values) % 2:
+                values += b'\0'
+
+    return (b'MM\0*' + struct.pack('>I', 8) + struct.pack('>H', entry_count)
+            + entries + struct.pack('>I', 0) + values)
+
+
+
+def make_xmp(properties):
+    """
+    Makes an XMP packet from a list of (namespace group, property, kind,
+    value) (see _xmp_properties).
+    """
+    namespaces = sorted(set(group for group, _, _, _ in properties))
+    xmlns = ''.join(f'\n  xmlns:{_xmp_namespaces[group][0]}='
+                    f'{quoteattr(_xmp_namespaces[group][1])}'
+                    for group in namespaces)
+
+    body = ''
+    for group, name, kind, value in properties:
+        prop = f'{_xmp_namespaces[group][0]}:{name}'
+        if kind == 'uri':
+            body += f'  <{prop} rdf:resource={quoteattr(value)}/>\n'
+        elif kind == 'text':
+            body += f'  <{prop}>{escape(value)}</{prop}>\n'
+        else:
+            container, lang = {'lang-alt': ('Alt', " xml:lang='x-default'"),
+                               'seq': ('Seq', ''),
+                               'bag': ('Bag', '')}[kind]
+            body += (f'  <{prop}>\n'
+                     f'   <rdf:{container}>\n'
+                     f'    <rdf:li{lang}>{escape(value)}</rdf:li>\n'
+                     f'   </rdf:{container}>\n'
+                     f'  </{prop}>\n')
+
+    return ("<?xpacket begin='\ufeff' id='W5M0MpCehiHzreSzNTczkc9d'?>\n"
+            "<x:xmpmeta xmlns:x='adobe:ns:meta/'>\n"
+            "<rdf:RDF xmlns:rdf='http://www.w3.org/1999/02/22-rdf-syntax-ns#'>\n"
+            f" <rdf:Description rdf:about=''{xmlns}>\n"
+            f"{body}"
+            " </rdf:Description>\n"
+            "</rdf:RDF>\n"
+            "</x:xmpmeta>\n"
+            "<?xpacket end='w'?>")
+
+
+
+def license_chunks(metadata):
+    """
+    Makes the PNG chunks for EXIF license metadata (a dict of exiftool tag
+    names and values, like m.license['exif']): an eXIf chunk for the EXIF
+    tags and an iTXt chunk with an XMP packet for the XMP tags.
+
+    Raises ValueError if there's a tag that can't be written without
+    exiftool.
+    """
+    exif_tags = {}
+    xmp_properties = []
+
+    for tag, value in metadata.items():
+        group, _, name = tag.rpartition(':')
+        group, name = group.lower(), name.lower()
+        value = str(value)
+
+        if group in _exif_groups and name in _exif_tags:
+            exif_tags[_exif_tags[name]] = value
+        elif (group, name) in _xmp_properties:
+            prop, kind = _xmp_properties[(group, name)]
+            xmp_properties.append((group, prop, kind, value))
+        else:
+            raise ValueError(f"'{tag}' isn't a tag orxporter can write "
+                             "into PNGs by itself.")
+
+    chunks = b''
+    if exif_tags:
+        chunks += make_chunk(b'eXIf', make_exif(exif_tags))
+    if xmp_properties:
+        # (keyword, no compression, no language or translated keyword.)
+        chunks += make_chunk(b'iTXt', XMP_KEYWORD + b'\0\0\0\0\0'
+                             + make_xmp(xmp_properties).encode('utf-8'))
+    return chunks
+
+
+
+def add_chunks(png_data, chunks):
+    """
+    Adds `chunks` to PNG data (right after the IHDR chunk), replacing any
+    EXIF or XMP metadata the PNG had already.
+    """
+    if not png_data.startswith(PNG_SIGNATURE):
+        raise ValueError("This isn't a PNG file.")
+
+    out = [PNG_SIGNATURE]
+    pos = len(PNG_SIGNATURE)
+    while pos < len(png_data):
+        if pos + 8 > len(png_data):
+            raise ValueError("This PNG file is cut off.")
+        length, chunk_type = struct.unpack('>I4s', png_data[pos:pos + 8])
+        end = pos + 12 + length
+        if end > len(png_data):
+            raise ValueError("This PNG file is cut off.")
+
+        # (metadata that's being replaced is left out.)
+        data = png_data[pos + 8:pos + 8 + length]
+        if not (chunk_type == b'eXIf' or
+                (chunk_type == b'iTXt' and data.startswith(XMP_KEYWORD + b'\0'))):
+            out.append(png_data[pos:end])
+
+        if chunk_type == b'IHDR':
+            out.append(chunks)
+        pos = end
+
+    return b''.join(out)
+
+
+
+def add_chunks_to_file(path, chunks):
+    """
+    Adds `chunks` to the PNG file at `path` (see add_chunks()). The file
+    is replaced rather than changed, so files it's linked to stay as they are.
+    """
+    with open(path, 'rb') as f:
+        png_data = add_chunks(f.read(), chunks)
+
+    def write(temp_path):
+        with open(temp_path, 'wb') as f:
+            f.write(png_data)
+
+    files.write_atomic(path, write)
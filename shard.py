@@ -0,0 +1,129 @@
+import heapq
+import os
+import shutil
+
+import files
+from timings import static_cost
+
+
+
+"""
+Files orxporter keeps in output and cache directories that aren't part of
+the export (and are different in every shard).
+"""
+_unmerged_files = ('.orxporter_journal', '.orxporter_timings.json',
+                   '.source_hashes.json')
+
+
+
+def parse_shard(arg):
+    """
+    Parses a shard given as 'K/N' (the Kth of N shards, counting from 1),
+    returning (K, N).
+    """
+    try:
+        k, n = (int(x) for x in arg.split('/'))
+    except ValueError:
+        raise ValueError(f"A shard ('{arg}') has to be given as K/N, ie. '2/4'.")
+
+    if n < 1 or not 1 <= k <= n:
+        raise ValueError(f"The shard '{arg}' doesn't exist. K has to be "
+                         "between 1 and N.")
+    return k, n
+
+
+
+def emoji_cost(m, input_path, e, formats):
+    """
+    A guess of how long an emoji takes to export in all of the `formats`.
+
+    This only uses the size of the emoji's source file and the formats, so
+    every machine working on the same emoji set comes up with the same cost.
+    """
+    try:
+        src_size = os.path.getsize(os.path.join(m.homedir, input_path, e['src']))
+    except (KeyError, OSError):
+        # (this emoji will fail the check in whichever shard it ends up in.)
+        src_size = 0
+
+    return (src_size + 1) * sum(static_cost(f) for f in formats)
+
+
+
+def partition(m, input_path, emoji, formats, shard):
+    """
+    Gets the emoji that belong to one shard (as (K, N)) of an export.
+
+    The emoji are split up so every shard has about the same cost (see
+    emoji_cost()), by giving the most expensive emoji out first, each to
+    whichever shard has the least so far. This only depends on the emoji
+    (and their order), the formats and the source files, so every shard
+    splits the set up the same way and each emoji ends up in exactly one.
+    """
+    k, n = shard
+
+    costs = [(-emoji_cost(m, input_path, e, formats), i)
+             for i, e in enumerate(emoji)]
+    costs.sort()
+
+    # (total cost, shard index) of each shard, cheapest first.
+    shards = [(0.0, s) for s in range(n)]
+    mine = set()
+    for cost, i in costs:
+        total, s = heapq.heappop(shards)
+        heapq.heappush(shards, (total - cost, s))
+        if s == k - 1:
+            mine.add(i)
+
+    return [e for i, e in enumerate(emoji) if i in mine]
+
+
+
+def merge_trees(src_dirs, dest_dir):
+    """
+    Merges the output (or cache) directories of several shards into one.
+
+    Shards export different emoji, so the same file showing up in two of
+    them is only allowed if both copies are identical (which they are for
+    cache entries). Files that were already in `dest_dir` before the merge
+    are replaced. Returns how many files were copied.
+    """
+    written = set()
+
+    for src_dir in src_dirs:
+        if not os.path.isdir(src_dir):
+            raise ValueError(f"The shard directory '{src_dir}' doesn't exist.")
+
+        for dirpath, _, filenames in os.walk(src_dir):
+            rel_dir = os.path.relpath(dirpath, src_dir)
+            os.makedirs(os.path.join(dest_dir, rel_dir), exist_ok=True)
+
+            for filename in filenames:
+                if rel_dir == '.' and filename in _unmerged_files:
+                    continue
+
+                src = os.path.join(dirpath, filename)
+                dest = os.path.join(dest_dir, rel_dir, filename)
+
+                if dest in written:
+                    if _same_contents(src, dest):
+                        continue
+                    raise ValueError(f"'{src}' is also in another shard "
+                                     "with different contents.")
+
+                # (written next to the destination and renamed over it, so
+                # a destination that's linked into a cache doesn't get
+                # changed through the link.)
+                files.write_atomic(dest, lambda temp_path: shutil.copy2(src, temp_path))
+                written.add(dest)
+
+    return len(written)
+
+
+
+def _same_contents(a, b):
+    """Returns True if the files at `a` and `b` have the same contents."""
+    if os.path.getsize(a) != os.path.getsize(b):
+        return False
+    with open(a, 'rb') as fa, open(b, 'rb') as fb:
+        return fa.read() == fb.read()
@@ -0,0 +1,81 @@
+import collections
+import concurrent.futures
+import os
+import threading
+
+
+
+"""
+How much source SVG text (in characters) a SourceStore keeps by default.
+That's plenty for every source of a big emoji set, while still keeping
+orxporter's memory use sane if it's pointed at something enormous.
+"""
+DEF_MAX_SIZE = 128 * 1024 * 1024
+
+
+
+class SourceStore:
+    """
+    Keeps the contents of source SVG files in memory, so that they're only
+    read once between checking the emoji and exporting them.
+
+    Files are keyed by their path and modification time, so a file that
+    changes is read again. Once the store holds more than `max_size`
+    characters, the files that were used longest ago are dropped.
+
+    A store can be used from several threads at once.
+    """
+
+    def __init__(self, max_size=DEF_MAX_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.files = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def read(self, path):
+        """
+        Gets the contents of the file at `path`, from the store if it's
+        there (and hasn't changed since), otherwise reading it.
+
+        Raises OSError if the file can't be read.
+        """
+        key = (path, os.stat(path).st_mtime_ns)
+
+        with self.lock:
+            if key in self.files:
+                self.files.move_to_end(key)
+                return self.files[key]
+
+        with open(path, 'r') as f:
+            text = f.read()
+
+        with self.lock:
+            if key not in self.files:
+                self.files[key] = text
+                self.size += len(text)
+
+            # drop the files used longest ago (but never the one just read)
+            while self.size > self.max_size and len(self.files) > 1:
+                _, old_text = self.files.popitem(last=False)
+                self.size -= len(old_text)
+
+        return text
+
+
+    def prefetch(self, paths, num_threads):
+        """
+        Reads a lot of files into the store at once, on `num_threads` threads.
+
+        Files that can't be read are left out, so that the error comes up
+        when they're actually needed.
+        """
+        def try_read(path):
+            try:
+                self.read(path)
+            except (OSError, UnicodeDecodeError):
+                pass
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as pool:
+            # (list() so that every read is finished before returning.)
+            list(pool.map(try_read, paths))
@@ -1,5 +1,8 @@
+import hashlib
 import re
 
+import util
+
 def translate_color(svg, pfrom, pto):
     """
     Translates colours from a source file's original colours into new colours.
@@ -15,6 +18,37 @@ def translated_colors(svg, pfrom, pto):
     _, changed = _translate_color(svg, pfrom, pto)
     return changed
 
+def translate_emoji_color(emoji, manifest, svg):
+    """
+    Translates the colours of an emoji's source SVG (`svg`) with its
+    colormap, returning the translated SVG and a dictionary of the colours
+    that were translated (like translated_colors()).
+
+    The result is kept on the emoji, so the cache key and the export of an
+    emoji share a single translation pass. It's a whole SVG, so it should
+    be let go of with forget_translated_color() once it's been used.
+    """
+    if 'color' not in emoji:
+        return svg, {}
+
+    # (the source is only compared by its SHA-256, so the memo doesn't keep
+    # a copy of it.)
+    src_id = hashlib.sha256(svg.encode('utf-8')).digest()
+    memo = emoji.get('translated_color')
+    if memo and memo['src'] == src_id:
+        return memo['svg'], memo['changed']
+
+    pfrom, pto = util.get_color_palettes(emoji, manifest)
+    res, changed = _translate_color(svg, pfrom, pto)
+    emoji['translated_color'] = {'src': src_id, 'svg': res, 'changed': changed}
+    return res, changed
+
+def forget_translated_color(emoji):
+    """
+    Drops the translated SVG kept on an emoji by translate_emoji_color().
+    """
+    emoji.pop('translated_color', None)
+
 def _translate_color(svg, pfrom, pto):
     """
     Translates colours on the svg file from "pfrom" to "pto", reporting also
@@ -32,7 +66,7 @@ def _translate_color(svg, pfrom, pto):
         res, count = re.subn(cr, cro, res, flags=re.IGNORECASE)
         if (cr[1], cr[3], cr[5]) == (cr[2], cr[4], cr[6]):
             cr = cr[0] + cr[1] + cr[3] + cr[5] + ';'
-            res, count2 = re.sub(cr, cro, res, flags=re.IGNORECASE)
+            res, count2 = re.subn(cr, cro, res, flags=re.IGNORECASE)
             count += count2
 
         # Record changes
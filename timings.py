@@ -0,0 +1,151 @@
+import datetime
+import heapq
+import json
+import os
+
+import files
+
+
+
+"""
+Rough guesses of how long a single task takes (in seconds) for each image
+format at 64x64, for formats that haven't been timed yet.
+Raster formats are scaled by their area from there.
+"""
+_default_cost_map = {
+    'svg': 0.002,
+    'png': 0.05,
+    'pngc': 0.06,
+    'webp': 0.08,
+    'jxl': 0.5,
+}
+
+"""
+How many past runs a timing is averaged over, so that it still follows
+changes in the machine or the emoji set.
+"""
+MAX_SAMPLES = 20
+
+
+
+def static_cost(f):
+    """
+    A guess of how long a single task in the format `f` takes, based only
+    on the format and its size (so it's the same on every machine).
+    """
+    image_format, _, size = f.partition('-')
+    cost = _default_cost_map.get(image_format, _default_cost_map['png'])
+
+    try:
+        cost *= (int(size) / 64) ** 2
+    except ValueError:
+        pass
+
+    return cost
+
+
+
+def format_duration(seconds):
+    """
+    Formats a number of seconds as a (rounded) human readable duration.
+    """
+    return str(datetime.timedelta(seconds=round(seconds)))
+
+
+
+class Timings:
+    """
+    How long export tasks have taken in previous runs, by format (which
+    includes the size) and renderer.
+
+    These are stored in a small JSON file and used to start the longest
+    tasks first, and to estimate how long an export will take.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.timings = {}
+
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.timings = json.load(f)
+            except (OSError, ValueError):
+                # a broken timings file only means worse estimates.
+                self.timings = {}
+
+
+    @staticmethod
+    def key(f, renderer):
+        """
+        The key of a format's timing (the renderer doesn't matter for svg).
+        """
+        return f if f == 'svg' else f'{f} {renderer}'
+
+
+    def known(self, f, renderer):
+        """
+        Returns True if there's a timing for this format and renderer.
+        """
+        return self.key(f, renderer) in self.timings
+
+
+    def estimate(self, f, renderer):
+        """
+        How long a single task in the format `f` is expected to take, in
+        seconds. Falls back to static_cost() if it hasn't been timed yet.
+        """
+        timing = self.timings.get(self.key(f, renderer))
+        if timing:
+            return timing['mean']
+        return static_cost(f)
+
+
+    def record(self, results, renderer):
+        """
+        Adds the work times of finished tasks (TaskResults) to the timings.
+        Tasks whose render came from the cache are left out, since they
+        don't say how long the task really takes.
+        """
+        for result in results:
+            if result.err is not None or result.cached:
+                continue
+
+            timing = self.timings.setdefault(self.key(result.format, renderer),
+                                             {'mean': 0.0, 'count': 0})
+            timing['count'] = min(timing['count'] + 1, MAX_SAMPLES)
+            timing['mean'] += (result.work - timing['mean']) / timing['count']
+
+
+    def save(self):
+        """
+        Writes the timings out to their file. (It's replaced rather than
+        written over, since shards sharing a cache directory share it.)
+        """
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        def write(temp_path):
+            with open(temp_path, 'w') as f:
+                json.dump(self.timings, f, indent=4, sort_keys=True)
+
+        try:
+            files.write_atomic(self.path, write)
+        except OSError as e:
+            raise Exception(f"Could not write timings to path '{self.path}'. More info: {e}")
+
+
+    def makespan(self, tasks, renderer, workers):
+        """
+        Estimates how long `tasks` ((emoji, format) pairs, in the order
+        they'll be started) will take on a number of `workers`.
+        """
+        finish_times = [0.0] * workers
+
+        for _, f in tasks:
+            # each task goes to whichever worker is free first.
+            heapq.heappush(finish_times, heapq.heappop(finish_times) +
+                           self.estimate(f, renderer))
+
+        return max(finish_times)